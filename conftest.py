@@ -2,47 +2,61 @@
 # SPDX-License-Identifier: CC0-1.0
 
 import copy
+import datetime
 import logging
 import pathlib
 import os
 import os.path
-import secrets
 from enum import Enum, auto
 from functools import partial
 from pytest import Config, FixtureRequest, Parser, fixture
-from typing import Generator
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, Generator, List, Optional, Set
+from utils.benchmark import Report
+from utils.corpus import CorpusInput, CorpusWriter
 from utils.device import (
-    Device, UsbDevice, generate_serial, state_dir, spawn_device
+    Device, UsbDevice, UsbipDevice, generate_serial, state_dir, spawn_device
+)
+from utils.opcard import OpcardComparison
+from utils.otp import ReferenceVectors
+from utils.recorder import Recorder
+from utils.secrets import (
+    EncryptionProfile,
+    credential_namespace,
+    open_secrets_app,
+    reconnect,
+    time_instructions,
 )
 from utils.subprocess import check_output
+from utils.supervisor import fail_fast, install_signal_handler
+from utils import tracing
+from utils.upgrade import CacheEntry, StateCache, UpgradeTest
 
 import pytest
 
 from pynitrokey.cli import CliException
 from pynitrokey.cli.nk3 import Context
-from pynitrokey.nk3.secrets_app import Instruction, SecretsApp
+from pynitrokey.nk3.secrets_app import (
+    Instruction, SecretsApp, SecretsAppException
+)
 
 CORPUS_PATH = "/tmp/corpus"
+ENCRYPTION_PROFILE = pytest.StashKey[EncryptionProfile]()
+OPCARD_COMPARISON = pytest.StashKey[OpcardComparison]()
+# paths of the test modules in which a runner crashed
+CRASHED_MODULES = pytest.StashKey[Set[str]]()
+# runner log directory of the current session
+RUNNER_LOG_DIR = pytest.StashKey[str]()
+# number of tests started in the current session
+TEST_COUNT = pytest.StashKey[int]()
+# number of the last test after which a checkpoint was restored, per path
+CHECKPOINT_RESTORED = pytest.StashKey[Dict[str, int]]()
 
 
 logger = logging.getLogger(__name__)
 log = logger.debug
 
 
-def _write_corpus(
-    ins: Instruction, data: bytes, prefix: str = "", path: str = CORPUS_PATH
-):
-    corpus_name = f"{prefix}"
-    corpus_path = f"{path}/{corpus_name}"
-    if len(data) > 255:
-        # Do not write records longer than 255 bytes
-        return
-    data = bytes([len(data)]) + data
-    with open(corpus_path, "ba") as f:
-        print(f"Writing corpus data to the path {corpus_path}")
-        f.write(data)
-
-
 def pytest_addoption(parser: Parser) -> None:
     parser.addoption(
         "--keep-state", action="store_true",
@@ -50,9 +64,32 @@ def pytest_addoption(parser: Parser) -> None:
     parser.addoption(
         "--upgrade", action="store_true",
     )
+    parser.addoption(
+        "--upgrade-cache", action="store_true",
+        help="Cache the old firmware state in upgrade tests.",
+    )
+    parser.addoption(
+        "--bisect", action="store", nargs="+", metavar="RUNNER",
+        help="Find the first runner binary that fails the upgrade tests.",
+    )
     parser.addoption(
         "--use-usb-devices", action="store", nargs="*"
     )
+    parser.addoption(
+        "--chrome-trace", metavar="PATH",
+        help="Record spans and events of the device operations and write "
+        "them to PATH in the Chrome trace format.",
+    )
+    parser.addoption(
+        "--runner-log-dir", default="runner-logs",
+        help="Directory for the compressed logs of the virtual devices, "
+        "with a subdirectory per test session. Default: runner-logs.",
+    )
+    parser.addoption(
+        "--wait-for-pcsc-reader", action="store_true", default=False,
+        help="Wait until the CCID reader of virtual devices is available in "
+        "pcscd (requires pyscard).",
+    )
     parser.addoption(
         "--generate-fuzzing-corpus",
         action="store_true",
@@ -65,6 +102,53 @@ def pytest_addoption(parser: Parser) -> None:
         default=CORPUS_PATH,
         help=f"Path to store the generated fuzzing corpus. Default: {CORPUS_PATH}.",
     )
+    parser.addoption(
+        "--minimize-corpus",
+        action="store",
+        metavar="PATH",
+        help="Write a minimized copy of the fuzzing corpus to PATH.",
+    )
+    parser.addoption(
+        "--fuzz",
+        action="store",
+        type=float,
+        metavar="SECONDS",
+        help="Fuzz the Secrets App with the corpus for SECONDS.",
+    )
+    parser.addoption(
+        "--fuzz-crash-path",
+        action="store",
+        default="fuzz-crashes",
+        help="Path to store crashing fuzzing inputs. Default: fuzz-crashes.",
+    )
+    parser.addoption(
+        "--record-apdu-trace",
+        action="store",
+        metavar="PATH",
+        help="Record all commands sent to the device to an APDU trace file.",
+    )
+    parser.addoption(
+        "--replay-apdu-trace",
+        action="store",
+        metavar="PATH",
+        help="Replay an APDU trace file and compare the responses.",
+    )
+    parser.addoption(
+        "--profile-encryption",
+        action="store_true",
+        default=False,
+        help="Profile the Secrets App commands per credential encryption.",
+    )
+    parser.addoption(
+        "--benchmark", action="store_true", default=False,
+        help="Enable benchmarks.",
+    )
+    parser.addoption(
+        "--benchmark-output",
+        action="store",
+        default="benchmark.json",
+        help="Path to store the benchmark results. Default: benchmark.json.",
+    )
     parser.addoption(
         "--model",
         action="store",
@@ -89,13 +173,99 @@ def pytest_addoption(parser: Parser) -> None:
     )
 
 
+def pytest_configure(config: Config) -> None:
+    if config.getoption("--chrome-trace"):
+        tracing.start()
+    install_signal_handler()
+    crashed_modules: Set[str] = set()
+    config.stash[CRASHED_MODULES] = crashed_modules
+    config.stash[TEST_COUNT] = 0
+    checkpoint_restored: Dict[str, int] = {}
+    config.stash[CHECKPOINT_RESTORED] = checkpoint_restored
+    # the log files are named after the runner PIDs, which are reused, so
+    # every session gets its own directory
+    session = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    config.stash[RUNNER_LOG_DIR] = os.path.join(
+        config.getoption("--runner-log-dir"), f"{session}-{os.getpid()}"
+    )
+    if config.getoption("--profile-encryption"):
+        config.stash[ENCRYPTION_PROFILE] = EncryptionProfile()
+
+
+def _usbip_devices(item: pytest.Item) -> List[UsbipDevice]:
+    funcargs = getattr(item, "funcargs", {})
+    return [d for d in funcargs.values() if isinstance(d, UsbipDevice)]
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_setup(item: pytest.Item) -> None:
+    item.config.stash[TEST_COUNT] += 1
+    if str(item.path) in item.config.stash[CRASHED_MODULES]:
+        pytest.skip("usbip-runner crashed in a previous test of this module")
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item: pytest.Item) -> Generator[None, None, None]:
+    # fail the test as soon as the runner crashes instead of waiting for
+    # timeouts, and skip the remaining tests of the module
+    devices = _usbip_devices(item)
+    for device in devices:
+        crash = device.check()
+        if crash:
+            item.config.stash[CRASHED_MODULES].add(str(item.path))
+            pytest.skip(str(crash))
+    with fail_fast(), tracing.span(logger, "test", test=item.nodeid):
+        yield
+    if any(device.supervisor.crashed for device in devices):
+        item.config.stash[CRASHED_MODULES].add(str(item.path))
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(
+    item: pytest.Item, call: pytest.CallInfo[None]
+) -> Generator[None, Any, None]:
+    # attach the runner output since the end of the previous test to failed
+    # reports instead of printing the full output
+    outcome = yield
+    report = outcome.get_result()
+    for device in _usbip_devices(item):
+        if report.failed:
+            report.sections.append(
+                (f"Captured {device.supervisor.name} output",
+                 device.supervisor.test_log())
+            )
+        if call.when == "teardown":
+            device.supervisor.start_test()
+
+
+def pytest_unconfigure(config: Config) -> None:
+    tracer = tracing.stop()
+    if tracer:
+        tracer.write(config.getoption("--chrome-trace"))
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config) -> None:
+    profile = config.stash.get(ENCRYPTION_PROFILE, None)
+    if profile and profile.tests:
+        terminalreporter.section("Secrets App encryption profile")
+        for line in profile.table():
+            terminalreporter.write_line(line)
+    comparison = config.stash.get(OPCARD_COMPARISON, None)
+    if comparison and comparison.operations:
+        terminalreporter.section("OpenPGP card operations")
+        for line in comparison.table():
+            terminalreporter.write_line(line)
+
+
 def pytest_collection_modifyitems(config, items):
     virtual = config.getoption("--virtual")
+    benchmark = config.getoption("--benchmark")
     hil = config.getoption("--hil")
     model = config.getoption("--model")
     test_suite = config.getoption("--test-suite")
 
     skip_virtual = pytest.mark.skip(reason="need --virtual option to run")
+    skip_benchmark = pytest.mark.skip(reason="need --benchmark option to run")
     skip_hil = pytest.mark.skip(reason="does not run on hil")
     skip_nkpk = pytest.mark.skip(reason="does not run on model nkpk")
     skip_slow = pytest.mark.skip(reason="slow test-suite not selected")
@@ -105,6 +275,9 @@ def pytest_collection_modifyitems(config, items):
         if not virtual:
             if "virtual" in item.keywords:
                 item.add_marker(skip_virtual)
+        if not benchmark:
+            if "benchmark" in item.keywords:
+                item.add_marker(skip_benchmark)
         if hil:
             if "hil_skip" in item.keywords:
                 item.add_marker(skip_hil)
@@ -122,15 +295,16 @@ def pytest_collection_modifyitems(config, items):
                 item.add_marker(skip_normal)
 
 
-def pytest_report_header(config: Config) -> str:
-    def get_version(binary: str) -> str:
-        path = os.path.join("bin", binary)
-        if os.path.exists(path):
-            version = "v" + check_output([path, "--version"]).split()[1]
-        else:
-            version = "[missing]"
-        return version
+def get_version(binary: str) -> str:
+    path = os.path.join("bin", binary)
+    if os.path.exists(path):
+        version = "v" + check_output([path, "--version"]).split()[1]
+    else:
+        version = "[missing]"
+    return version
+
 
+def pytest_report_header(config: Config) -> str:
     runner_version = get_version("usbip-runner")
     provisioner_version = get_version("usbip-provisioner")
     if runner_version == provisioner_version:
@@ -161,7 +335,13 @@ def device(request: FixtureRequest) -> Generator[Device, None, None]:
         with state_dir(keep_state) as s:
             ifs = os.path.join(s, "ifs.bin")
             efs = os.path.join(s, "efs.bin")
-            with spawn_device(ifs, efs) as device:
+            wait_for_reader = request.config.getoption(
+                "--wait-for-pcsc-reader"
+            )
+            log_dir = request.config.stash[RUNNER_LOG_DIR]
+            with spawn_device(
+                ifs, efs, wait_for_reader=wait_for_reader, log_dir=log_dir
+            ) as device:
                 yield device
 
 
@@ -175,7 +355,10 @@ def touch_device(request: FixtureRequest) -> Generator[Device, None, None]:
         with state_dir(keep_state) as s:
             ifs = os.path.join(s, "ifs.bin")
             efs = os.path.join(s, "efs.bin")
-            with spawn_device(ifs, efs, user_presence=True) as device:
+            log_dir = request.config.stash[RUNNER_LOG_DIR]
+            with spawn_device(
+                ifs, efs, user_presence=True, log_dir=log_dir
+            ) as device:
                 yield device
 
 
@@ -197,40 +380,118 @@ def efs(request: FixtureRequest) -> Generator[str, None, None]:
 def serial() -> str:
     return generate_serial()
 
+
+@fixture(scope="session")
+def benchmark_report(request: FixtureRequest) -> Generator[Report, None, None]:
+    report = Report({
+        "date": datetime.datetime.now().isoformat(),
+        "model": request.config.getoption("--model"),
+        "usb_devices": request.config.getoption("--use-usb-devices"),
+        "runner": get_version("usbip-runner"),
+        "runner_old": get_version("usbip-runner-old"),
+    })
+    yield report
+    if report.results:
+        report.write(request.config.getoption("--benchmark-output"))
+
+
+@fixture(scope="session")
+def opcard_comparison(request: FixtureRequest) -> OpcardComparison:
+    if request.config.getoption("--use-usb-devices"):
+        build = "[usb]"
+    else:
+        build = get_version("usbip-runner")
+    comparison = OpcardComparison(build)
+    request.config.stash[OPCARD_COMPARISON] = comparison
+    return comparison
+
+
+@fixture(scope="session")
+def upgrade_state_cache(request: FixtureRequest) -> Optional[StateCache]:
+    if not request.config.getoption("--upgrade-cache"):
+        return None
+    return StateCache()
+
+
+@fixture
+def upgrade_cache(
+    request: FixtureRequest, upgrade_state_cache: Optional[StateCache]
+) -> Optional[CacheEntry]:
+    if not upgrade_state_cache:
+        return None
+    return upgrade_state_cache.entry(request.node.nodeid)
+
+
+@fixture
+def upgrade(
+    request: FixtureRequest,
+    serial: str,
+    ifs: str,
+    efs: str,
+    upgrade_cache: Optional[CacheEntry],
+) -> Callable[[UpgradeTest[Any, Any]], None]:
+    binaries = request.config.getoption("--bisect")
+
+    def run(test: UpgradeTest[Any, Any]) -> None:
+        if binaries:
+            failing = test.bisect(serial, ifs, efs, binaries, upgrade_cache)
+            assert not failing, f"first failing runner: {failing}"
+        else:
+            test.run_upgrade(serial, ifs, efs, upgrade_cache)
+
+    return run
+
 # extra secrets tests fixtures
 
 
 @fixture(scope="session")
-def generate_corpus_args(request: FixtureRequest):
-    return request.config.getoption(
-        "--generate-fuzzing-corpus"
-    ), request.config.getoption("--fuzzing-corpus-path")
+def corpus_writer(request: FixtureRequest):
+    if not request.config.getoption("--generate-fuzzing-corpus"):
+        yield None
+        return
+    corpus_path = request.config.getoption("--fuzzing-corpus-path")
+    print(f"\n*** Generating corpus for Secrets App fuzzing at {corpus_path}")
+    with CorpusWriter(str(corpus_path)) as writer:
+        yield writer
+    log(f"Skipped {writer.duplicates} duplicate corpus inputs")
+    log(f"Dropped {writer.dropped_records} too long corpus records")
 
 
 @fixture(scope="function")
-def corpus_func(request: FixtureRequest, generate_corpus_args):
+def corpus_func(request: FixtureRequest, corpus_writer):
     """
-    This fixture has to be function-scoped, to get different prefix "pre" for the per-test output
+    This fixture has to be function-scoped, to collect the commands of every
+    test as a separate input
     """
-    generate_corpus, corpus_path = generate_corpus_args
-    if generate_corpus:
-        print(f"\n*** Generating corpus for Secrets App fuzzing at {corpus_path}")
-        pathlib.Path(corpus_path).mkdir(exist_ok=True)
-        # Add some random suffix to have separate outputs for parametrized test cases
-        pre = secrets.token_bytes(4).hex()
-        pre = f"{request.function.__name__}-{pre}"
-        return partial(_write_corpus, prefix=pre, path=corpus_path)
-    return None
+    if corpus_writer is None:
+        yield None
+        return
+    corpus_input = CorpusInput(request.function.__name__)
+    yield corpus_input
+    corpus_writer.add(corpus_input.name, corpus_input.records)
 
 
 @fixture(scope="session")
-def dev():
+def otp_vectors() -> ReferenceVectors:
+    return ReferenceVectors()
+
+
+@fixture(scope="session")
+def dev(request: FixtureRequest):
     ctx = Context(None)
     try:
-        return ctx.connect_device()
+        device = ctx.connect_device()
     except CliException as e:
         if "No Nitrokey 3 device found" in str(e):
             pytest.skip(f"Cannot connect to the Nitrokey 3 device. Error: {e}")
+        raise
+    trace = request.config.getoption("--record-apdu-trace")
+    with tracing.trace_call_app(device, logger):
+        if trace:
+            with Recorder(trace) as recorder, recorder.attach(device):
+                yield device
+        else:
+            yield device
 
 
 class CredEncryptionType(Enum):
@@ -240,13 +501,34 @@ class CredEncryptionType(Enum):
     HardwareBased = auto()
 
 
+def _use_checkpoints(config: Config) -> bool:
+    return bool(config.getoption("--virtual")) and not config.getoption(
+        "--use-usb-devices"
+    )
+
+
+def _connect_dev(request: FixtureRequest) -> Any:
+    """
+    Returns the dev fixture.  On virtual devices, the device of the module is
+    started first and dev is connected to its current runner.
+    """
+    if not _use_checkpoints(request.config):
+        return request.getfixturevalue("dev")
+    device = request.getfixturevalue("device")
+    # supervise the runner during the test, see _usbip_devices
+    request.node.funcargs["device"] = device
+    dev = request.getfixturevalue("dev")
+    reconnect(dev, device)
+    return dev
+
+
 @fixture(scope="function")
-def secretsAppRaw(corpus_func, dev) -> SecretsApp:
+def secretsAppRaw(request: FixtureRequest, corpus_func) -> SecretsApp:
     """
     Create Secrets App client with or without corpus files generations.
     No other functional alterations.
     """
-    app = SecretsApp(dev, logfn=log)
+    app = SecretsApp(_connect_dev(request), logfn=log)
     app.write_corpus_fn = corpus_func
     return app
 
@@ -259,7 +541,7 @@ def secretsAppRaw(corpus_func, dev) -> SecretsApp:
     ],
     ids=lambda x: f"Key{str(x).split('.')[-1]}",
 )
-def secretsApp(request, secretsAppRaw) -> SecretsApp:
+def secretsApp(request, secretsAppRaw) -> Generator[SecretsApp, None, None]:
     """
     Create Secrets App client in two forms, w/ or w/o PIN-based encryption
     """
@@ -282,7 +564,13 @@ def secretsApp(request, secretsAppRaw) -> SecretsApp:
 
     app._metadata["fixture_type"] = credentials_type
 
-    return app
+    profile = request.config.stash.get(ENCRYPTION_PROFILE, None)
+    if profile:
+        with time_instructions(app) as samples:
+            yield app
+        profile.add(request.param.name, samples)
+    else:
+        yield app
 
 
 @fixture(scope="function")
@@ -298,6 +586,87 @@ def secretsAppNoLog(secretsApp) -> SecretsApp:
     return secretsApp
 
 
+@fixture(scope="function")
+def secretsAppNamespace(
+    deviceCheckpoint, secretsApp
+) -> Generator[SecretsApp, None, None]:
+    """
+    Alternative to secretsAppResetLogin for tests that only need their own
+    credentials to be absent: the credential names are prefixed with a
+    unique namespace, and only the credentials registered by the test are
+    removed afterwards. The Secrets App is only reset if the PIN cannot be
+    verified, or if it is filled up with credentials from other tests.
+    On virtual devices, the state from secretsCheckpoint is restored
+    instead, see deviceCheckpoint.
+    """
+    if deviceCheckpoint:
+        secretsApp.verify_pin_raw(PIN)
+        yield secretsApp
+        return
+    try:
+        secretsApp.verify_pin_raw_always(PIN)
+        credentials = len(secretsApp.list())
+    except SecretsAppException:
+        credentials = None
+    if credentials is None or credentials > NAMESPACE_MAX_CREDENTIALS:
+        secretsApp.reset()
+        secretsApp.set_pin_raw(PIN)
+    verify_pin = partial(secretsApp.verify_pin_raw_always, PIN)
+    with credential_namespace(secretsApp, verify_pin):
+        secretsApp.verify_pin_raw(PIN)
+        yield secretsApp
+
+
+@fixture(scope="module")
+def secretsCheckpoint(
+    request: FixtureRequest, device: Device
+) -> Generator[str, None, None]:
+    """
+    Snapshot of the state files of a virtual device with a reset Secrets App
+    and the PIN set.
+    """
+    if not isinstance(device, UsbipDevice):
+        pytest.skip("Checkpoints are only supported for virtual devices")
+    with open_secrets_app(device, log) as app:
+        app.reset()
+        app.set_pin_raw(PIN)
+    with TemporaryDirectory() as path:
+        device.snapshot(path)
+        # the current test starts with the state of the snapshot
+        restored = request.config.stash[CHECKPOINT_RESTORED]
+        restored[path] = request.config.stash[TEST_COUNT] - 1
+        yield path
+        del restored[path]
+
+
+@fixture(scope="function")
+def deviceCheckpoint(
+    request: FixtureRequest,
+) -> Generator[Optional[str], None, None]:
+    """
+    Transactional state for Secrets App tests on virtual devices: the state
+    from secretsCheckpoint is restored after the test, and before the test
+    if another test was executed since the last restore.  Every restore
+    restarts the runner, so the dev handle is reconnected to the new runner.
+    Yields the checkpoint path, or None if checkpoints are not used.
+    """
+    if not _use_checkpoints(request.config):
+        yield None
+        return
+    device = request.getfixturevalue("device")
+    path = request.getfixturevalue("secretsCheckpoint")
+    restored = request.config.stash[CHECKPOINT_RESTORED]
+    if restored[path] != request.config.stash[TEST_COUNT] - 1:
+        device.restore(path)
+    dev = _connect_dev(request)
+    yield path
+    device.restore(path)
+    reconnect(dev, device)
+    restored[path] = request.config.stash[TEST_COUNT]
+
+
+# secretsAppNamespace resets the device if there are more credentials
+NAMESPACE_MAX_CREDENTIALS = 30
 FEATURE_BRUTEFORCE_PROTECTION_ENABLED = False
 DELAY_AFTER_FAILED_REQUEST_SECONDS = 2
 CREDID = "CRED ID"
@@ -0,0 +1,8 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+from typing import Any
+
+
+def readers() -> list[Any]:
+    pass
@@ -0,0 +1,2 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
@@ -0,0 +1,35 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+from typing import Any
+
+SCARD_SCOPE_USER: int
+SCARD_S_SUCCESS: int
+SCARD_E_NO_READERS_AVAILABLE: int
+SCARD_E_TIMEOUT: int
+SCARD_E_UNKNOWN_READER: int
+SCARD_STATE_UNAWARE: int
+SCARD_STATE_CHANGED: int
+SCARD_STATE_PRESENT: int
+
+
+def SCardEstablishContext(scope: int) -> tuple[int, Any]:
+    pass
+
+
+def SCardReleaseContext(context: Any) -> int:
+    pass
+
+
+def SCardListReaders(context: Any, groups: list[str]) -> tuple[int, list[str]]:
+    pass
+
+
+def SCardGetStatusChange(
+    context: Any, timeout: int, states: list[tuple[str, int]]
+) -> tuple[int, list[tuple[str, int, list[int]]]]:
+    pass
+
+
+def SCardGetErrorMessage(hresult: int) -> str:
+    pass
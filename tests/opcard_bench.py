@@ -0,0 +1,130 @@
+"""
+Benchmarks for the OpenPGP card application.
+Requires a live device, or an USB-IP simulation, and the --benchmark flag.
+The oct benchmarks require the oct, sq and sqv tools, and the PC/SC
+benchmarks require pyscard.
+"""
+
+import os.path
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from utils.benchmark import Samples
+from utils.opcard import (
+    OPCARD_ALGORITHMS,
+    OpenPgpCard,
+    OpenPgpSession,
+    decryption_input,
+    signature_input,
+    verify_signature,
+)
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.nkpk_skip]
+
+# number of key generations per algorithm
+GENERATE_ROUNDS = 3
+# number of signatures and decryptions per algorithm
+ROUNDS = 10
+
+
+def helper_algorithms():
+    # RSA 4096 key generation takes several minutes on the device
+    return [
+        pytest.param(a, marks=pytest.mark.slow) if a == "rsa4096" else a
+        for a in OPCARD_ALGORITHMS
+    ]
+
+
+@pytest.mark.parametrize("algorithm", helper_algorithms())
+def test_opcard_operations(
+    device, algorithm, benchmark_report, opcard_comparison
+):
+    """
+    Generate keys with the given algorithm, then sign and decrypt data with
+    the card.  All signatures are verified with sqv, and all decrypted
+    messages are compared with the plaintext.
+    """
+    data = b"some random data to be signed here"
+    samples = {
+        "generate": Samples(),
+        "sign": Samples(),
+        "decrypt": Samples(),
+    }
+
+    with TemporaryDirectory() as d:
+        card = OpenPgpCard(device.serial, d)
+        data_path = os.path.join(d, "input-data")
+        sig_path = os.path.join(d, "data.sig")
+        message_path = os.path.join(d, "message.pgp")
+        with open(data_path, "wb") as f:
+            f.write(data)
+
+        card.factory_reset()
+        for _ in range(GENERATE_ROUNDS):
+            with samples["generate"].measure():
+                card.generate(algorithm)
+
+        for _ in range(ROUNDS):
+            with samples["sign"].measure():
+                card.sign(data_path, sig_path)
+            card.verify(data_path, sig_path)
+
+        card.encrypt(data_path, message_path)
+        for _ in range(ROUNDS):
+            with samples["decrypt"].measure():
+                plaintext = card.decrypt(message_path)
+            assert plaintext == data
+
+    for operation, s in samples.items():
+        opcard_comparison.add(algorithm, operation, s, client="oct")
+    benchmark_report.add(
+        "opcard_operations",
+        {"algorithm": algorithm, "client": "oct"},
+        **{operation: s.summary() for operation, s in samples.items()},
+    )
+
+
+@pytest.mark.parametrize("algorithm", helper_algorithms())
+def test_opcard_session_operations(
+    device, algorithm, benchmark_report, opcard_comparison
+):
+    """
+    Like test_opcard_operations, but all operations are executed with a
+    single PC/SC connection instead of one oct process per operation.  The
+    signatures and decrypted session keys are checked on the host.
+    """
+    pytest.importorskip("smartcard")
+    data = b"some random data to be signed here"
+    samples = {
+        "generate": Samples(),
+        "sign": Samples(),
+        "decrypt": Samples(),
+    }
+
+    with OpenPgpSession.open(device.serial) as session:
+        session.factory_reset()
+        for _ in range(GENERATE_ROUNDS):
+            with samples["generate"].measure():
+                keys = session.generate(algorithm)
+
+        digest = signature_input(algorithm, data)
+        for _ in range(ROUNDS):
+            with samples["sign"].measure():
+                signature = session.sign(digest)
+            verify_signature(algorithm, keys["sig"], data, signature)
+
+        for _ in range(ROUNDS):
+            (message, expected) = decryption_input(keys["dec"])
+            with samples["decrypt"].measure():
+                plaintext = session.decrypt(message)
+            assert plaintext == expected
+
+    for operation, s in samples.items():
+        opcard_comparison.add(algorithm, operation, s, client="pcsc")
+    benchmark_report.add(
+        "opcard_operations",
+        {"algorithm": algorithm, "client": "pcsc"},
+        reader_time=getattr(device, "reader_time", None),
+        **{operation: s.summary() for operation, s in samples.items()},
+    )
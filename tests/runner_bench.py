@@ -0,0 +1,70 @@
+"""
+Benchmarks for the usbip-runner setup.
+Requires the --virtual and --benchmark flags.
+"""
+
+import os
+import os.path
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from pynitrokey.nk3.secrets_app import Kind
+from utils.benchmark import Samples
+from utils.device import spawn_device
+from utils.secrets import open_secrets_app
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.virtual]
+
+# RUST_LOG values compared by the logging overhead benchmark
+RUST_LOG_LEVELS = ["off", "info", "debug", "trace"]
+ROUNDS = 50
+
+
+def test_logging_overhead(monkeypatch, benchmark_report):
+    """
+    Measure the latency of Secrets App commands with different runner log
+    levels.  The runner output is piped into the supervisor and written to a
+    compressed log file, as in all other tests.
+    """
+    latency = {}
+    for level in RUST_LOG_LEVELS:
+        monkeypatch.setenv("RUST_LOG", level)
+        samples = Samples()
+        with TemporaryDirectory() as d:
+            ifs = os.path.join(d, "ifs.bin")
+            efs = os.path.join(d, "efs.bin")
+            log_dir = os.path.join(d, "logs")
+            with spawn_device(
+                ifs, efs, provision=False, log_dir=log_dir
+            ) as device:
+                with open_secrets_app(device) as secretsApp:
+                    secretsApp.reset()
+                    secretsApp.register(
+                        b"logging", b"\x00" * 20, kind=Kind.Hotp
+                    )
+                    for _ in range(ROUNDS):
+                        with samples.measure():
+                            secretsApp.calculate(b"logging")
+            # wait until the output is read and the log file is closed
+            device.supervisor.join()
+            lines = device.supervisor.line_count
+            log_path = device.supervisor.log_path
+            log_size = os.path.getsize(log_path) if log_path else 0
+
+        latency[level] = {
+            "lines": lines,
+            "log_size": log_size,
+            **samples.summary(),
+        }
+
+    baseline = latency["off"]["p50"]
+    for level, result in latency.items():
+        result["overhead"] = result["p50"] / baseline if baseline else 0.0
+        print(
+            f"RUST_LOG={level:<6}: p50 {result['p50'] * 1000:6.2f} ms "
+            f"({result['overhead']:.2f}x), {result['lines']} lines"
+        )
+    benchmark_report.add(
+        "runner_logging", {"rounds": ROUNDS}, latency=latency
+    )
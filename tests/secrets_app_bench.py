@@ -0,0 +1,582 @@
+"""
+Benchmarks for the Secrets application.
+Requires a live device, or an USB-IP simulation, and the --benchmark flag.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import time
+
+import pytest
+from fido2.ctap import CtapError
+
+from pynitrokey.conftest import (
+    CREDID,
+    DELAY_AFTER_FAILED_REQUEST_SECONDS,
+    DIGITS,
+    FEATURE_BRUTEFORCE_PROTECTION_ENABLED,
+    HOTP_WINDOW_SIZE,
+    PIN,
+    PIN2,
+    SECRET,
+)
+from pynitrokey.nk3.device import Nitrokey3Device
+from pynitrokey.nk3.secrets_app import (
+    Algorithm,
+    Kind,
+    SecretsApp,
+    SecretsAppException,
+)
+from utils.benchmark import Samples, fill_curve, linear_fit
+from utils.secrets import (
+    STATUS_OK,
+    YK_API_REQ,
+    YK_HMAC_SLOTS,
+    bruteforce_reverse_hotp,
+    bulk_register,
+    calculate_all,
+    chained_list,
+    get_padded,
+    open_secrets_app,
+    send_receive_ins,
+    time_instructions,
+)
+
+CREDENTIAL_LABEL_MAX_SIZE = 127
+# Upper bound for the number of credentials registered when filling the device
+CAPACITY_LIMIT = 2000
+# Number of repetitions of the workload in the latency benchmarks
+ROUNDS = 20
+# Credential counts for the scaling benchmarks, up to the capacity
+SCALING_COUNTS = [1, 10, 50, 100, 250, 500, 1000, CAPACITY_LIMIT]
+# Password Safe field sizes, up to the maximum length
+PWS_FIELD_SIZES = [8, 32, 64, 127]
+# Challenge lengths for the challenge-response benchmark, 1 is used by
+# KeepassXC and 63 is the maximum
+HMAC_CHALLENGE_LENGTHS = [1, 32, 63]
+# Credential counts for the CalculateAll benchmark
+CALCULATE_ALL_COUNTS = [1, 5, 10, 25, 50, 100]
+# Duration of the reverse HOTP brute-force benchmark in seconds
+BRUTEFORCE_DURATION = 10
+# Number of possible 6-digit codes
+CODE_SPACE = 10**6
+pytestmark = pytest.mark.benchmark
+
+
+def helper_params(app: SecretsApp, **params) -> dict:
+    """
+    Add the fixture's encryption type to the benchmark parameters
+    """
+    return dict(encryption=app._metadata["fixture_type"].name, **params)
+
+
+def helper_devices(request, dev) -> list:
+    """
+    Return all connected devices whitelisted with --use-usb-devices, or the
+    default device. The other devices are closed immediately, and the
+    returned devices when the test is finished.
+    """
+    serials = request.config.getoption("--use-usb-devices")
+    if not serials:
+        return [dev]
+    allowed = {int(serial, 16) for serial in serials}
+    devices = []
+    for device in Nitrokey3Device.list():
+        uuid = device.uuid()
+        if uuid is not None and int(uuid) in allowed:
+            request.addfinalizer(device.close)
+            devices.append(device)
+        else:
+            device.close()
+    return devices or [dev]
+
+
+def helper_calculate_all_supported(app: SecretsApp) -> bool:
+    """
+    Check if the device supports CalculateAll, which is deactivated in
+    current firmware versions
+    """
+    try:
+        app.verify_pin_raw(PIN)
+        calculate_all(app, 0)
+    except (CtapError, SecretsAppException):
+        return False
+    return True
+
+
+def helper_label(i: int, long_labels: bool) -> bytes:
+    label = f"LOAD{i:04}"
+    if long_labels:
+        label = (label * 100)[:CREDENTIAL_LABEL_MAX_SIZE]
+    return label.encode()
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize(
+    "long_labels", [False, True], ids=lambda x: "long" if x else "short"
+)
+def test_registration_throughput(
+    secretsAppResetLogin, benchmark_report, long_labels
+):
+    """
+    Fill the device with OTP credentials, and record the latency of every
+    registration, the throughput depending on the fill level and the capacity.
+    """
+    secretsApp = secretsAppResetLogin
+    result = bulk_register(
+        secretsApp,
+        [
+            dict(
+                credid=helper_label(i, long_labels),
+                secret=SECRET,
+                digits=DIGITS,
+                kind=Kind.Hotp,
+            )
+            for i in range(CAPACITY_LIMIT)
+        ],
+        PIN,
+    )
+    assert result.registered, "Could not register any credential"
+
+    benchmark_report.add(
+        "secrets_registration",
+        helper_params(secretsApp, long_labels=long_labels),
+        capacity=len(result.registered),
+        status=result.status.hex() if result.status else None,
+        latency=Samples(result.latencies).summary(),
+        curve=fill_curve(result.latencies),
+    )
+
+
+def test_instruction_latency(
+    secretsAppResetLogin, otp_vectors, benchmark_report
+):
+    """
+    Record the latency of every instruction used in a typical OTP and Password
+    Safe workload. Each round registers, uses and removes its own credentials,
+    and ends with a reset of the Secrets App and setting the PIN again, so
+    the number of stored credentials stays constant. CalculateAll is only
+    included if the device supports it.
+    """
+    secretsApp = secretsAppResetLogin
+    code = int(otp_vectors.hotp(SECRET, 0))
+    with_calculate_all = helper_calculate_all_supported(secretsApp)
+
+    def with_pin(f, *args, **kwargs):
+        secretsApp.verify_pin_raw(PIN)
+        return f(*args, **kwargs)
+
+    with time_instructions(secretsApp) as samples:
+        for i in range(ROUNDS):
+            name = helper_label(i, False)
+            reverse = name + b"REV"
+            with_pin(
+                secretsApp.register,
+                name,
+                SECRET,
+                DIGITS,
+                kind=Kind.Hotp,
+                login=b"login",
+                password=b"password",
+            )
+            with_pin(secretsApp.calculate, name)
+            if with_calculate_all:
+                with_pin(calculate_all, secretsApp, i)
+            with_pin(secretsApp.list)
+            with_pin(secretsApp.get_credential, name)
+            with_pin(secretsApp.rename_credential, name, name + b"R")
+            with_pin(secretsApp.delete, name + b"R")
+
+            with_pin(
+                secretsApp.register,
+                reverse,
+                SECRET,
+                DIGITS,
+                kind=Kind.HotpReverse,
+            )
+            with_pin(secretsApp.verify_code, reverse, code)
+            with_pin(secretsApp.delete, reverse)
+
+            secretsApp.select()
+            secretsApp.change_pin_raw(PIN, PIN2)
+            secretsApp.change_pin_raw(PIN2, PIN)
+            secretsApp.reset()
+            secretsApp.set_pin_raw(PIN)
+
+    benchmark_report.add(
+        "secrets_instruction_latency",
+        helper_params(
+            secretsApp, rounds=ROUNDS, calculate_all=with_calculate_all
+        ),
+        latency={ins: s.summary() for ins, s in sorted(samples.items())},
+    )
+
+
+@pytest.mark.virtual
+def test_checkpoint_restore(device, secretsCheckpoint, benchmark_report):
+    """
+    Compare the two ways to prepare the Secrets App for a test: resetting it
+    and setting the PIN, as done by secretsAppResetLogin, or restarting the
+    runner with the state from secretsCheckpoint.
+    """
+    reset = Samples()
+    restore = Samples()
+    for _ in range(ROUNDS):
+        with open_secrets_app(device) as secretsApp:
+            with reset.measure():
+                secretsApp.reset()
+                secretsApp.set_pin_raw(PIN)
+                secretsApp.verify_pin_raw(PIN)
+        with restore.measure():
+            device.restore(secretsCheckpoint)
+            with open_secrets_app(device) as secretsApp:
+                secretsApp.verify_pin_raw(PIN)
+
+    benchmark_report.add(
+        "secrets_checkpoint",
+        {"rounds": ROUNDS},
+        reset=reset.summary(),
+        restore=restore.summary(),
+    )
+
+
+def test_revhotp_bruteforce(request, dev, benchmark_report):
+    """
+    Measure the sustained rate of reverse HOTP verification attempts, on all
+    devices in parallel, and project the time needed to try all 6-digit
+    codes. With the brute-force protection, the rate has to be limited by
+    the delay after a failed verification.
+    """
+    devices = helper_devices(request, dev)
+
+    def attack(device):
+        secretsApp = SecretsApp(device)
+        secretsApp.reset()
+        secretsApp.register(
+            CREDID.encode(),
+            SECRET,
+            digits=6,
+            kind=Kind.HotpReverse,
+            algo=Algorithm.Sha1,
+        )
+        # start far from the valid codes at the initial counter
+        return bruteforce_reverse_hotp(
+            secretsApp, CREDID.encode(), BRUTEFORCE_DURATION, start=100_000
+        )
+
+    with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+        results = list(executor.map(attack, devices))
+
+    rate = sum(result.rate for result in results)
+    assert rate > 0, "No verification attempt was evaluated"
+    print(
+        f"{rate:.1f} attempts/s on {len(devices)} device(s), "
+        f"{CODE_SPACE / rate / 3600:.1f} h for all codes"
+    )
+    benchmark_report.add(
+        "secrets_revhotp_bruteforce",
+        {
+            "devices": len(devices),
+            "protection": FEATURE_BRUTEFORCE_PROTECTION_ENABLED,
+        },
+        attempts=[result.attempts for result in results],
+        rejected=[result.rejected for result in results],
+        rate=rate,
+        exhaust_time=CODE_SPACE / rate,
+        expected_time=CODE_SPACE / rate / 2,
+    )
+
+    if FEATURE_BRUTEFORCE_PROTECTION_ENABLED:
+        for result in results:
+            max_attempts = result.duration / DELAY_AFTER_FAILED_REQUEST_SECONDS
+            assert result.attempts <= max_attempts + 1
+
+
+@pytest.mark.parametrize(
+    "start_value",
+    [
+        0,
+        0xFFFF,
+        0xFFFFFFFF - HOTP_WINDOW_SIZE - 2,
+        0xFFFFFFFF - HOTP_WINDOW_SIZE,
+    ],
+)
+def test_revhotp_window_latency(
+    secretsAppNamespace, otp_vectors, benchmark_report, start_value
+):
+    """
+    Record the latency of the reverse HOTP verification depending on how far
+    the device has to search ahead of its counter, including the rejection
+    of a code outside of the window and the counter overflow edges.
+    """
+    secretsApp = secretsAppNamespace
+    offsets = list(range(HOTP_WINDOW_SIZE + 2))
+    samples = {offset: Samples() for offset in offsets}
+    for offset in offsets:
+        code = int(otp_vectors.hotp(SECRET, start_value + offset))
+        for i in range(ROUNDS // 4):
+            name = f"REV{offset}-{i}".encode()
+            secretsApp.verify_pin_raw(PIN)
+            secretsApp.register(
+                name,
+                SECRET,
+                DIGITS,
+                kind=Kind.HotpReverse,
+                initial_counter_value=start_value,
+            )
+            secretsApp.verify_pin_raw(PIN)
+            if offset > HOTP_WINDOW_SIZE:
+                with pytest.raises(
+                    SecretsAppException, match="VerificationFailed"
+                ):
+                    with samples[offset].measure():
+                        secretsApp.verify_code(name, code)
+                if FEATURE_BRUTEFORCE_PROTECTION_ENABLED:
+                    time.sleep(DELAY_AFTER_FAILED_REQUEST_SECONDS)
+            else:
+                with samples[offset].measure():
+                    secretsApp.verify_code(name, code)
+            secretsApp.verify_pin_raw(PIN)
+            secretsApp.delete(name)
+
+    accepted = offsets[:-1]
+    benchmark_report.add(
+        "secrets_revhotp_window",
+        helper_params(secretsApp, start_value=start_value),
+        latency={offset: samples[offset].summary() for offset in offsets},
+        fit=linear_fit(
+            accepted, [samples[offset].summary()["p50"] for offset in accepted]
+        ),
+    )
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize(
+    "pws", [False, True], ids=lambda x: "pws" if x else "otp"
+)
+@pytest.mark.parametrize(
+    "long_labels", [False, True], ids=lambda x: "long" if x else "short"
+)
+def test_list_scaling(
+    secretsAppResetLogin, benchmark_report, long_labels, pws
+):
+    """
+    Fill the device step by step, and record the latency of list(), and of
+    the raw List command with the SendRemaining requests needed to receive
+    the full response, with and without PIN verification.
+    """
+    secretsApp = secretsAppResetLogin
+    extra = dict(login=b"login", password=b"password") if pws else {}
+    registered = 0
+    steps = []
+    for count in SCALING_COUNTS:
+        result = bulk_register(
+            secretsApp,
+            [
+                dict(
+                    credid=helper_label(i, long_labels),
+                    secret=SECRET,
+                    digits=DIGITS,
+                    kind=Kind.Hotp,
+                    **extra,
+                )
+                for i in range(registered, count)
+            ],
+            PIN,
+        )
+        registered += len(result.registered)
+
+        for verify_pin in [False, True]:
+            list_samples = Samples()
+            raw_samples = Samples()
+            for _ in range(ROUNDS // 4):
+                if verify_pin:
+                    secretsApp.verify_pin_raw_always(PIN)
+                with list_samples.measure():
+                    secretsApp.list()
+                if verify_pin:
+                    secretsApp.verify_pin_raw_always(PIN)
+                response = chained_list(secretsApp)
+                assert response.status == STATUS_OK
+                raw_samples.add(response.duration)
+            steps.append(
+                {
+                    "count": registered,
+                    "verify_pin": verify_pin,
+                    "list": list_samples.summary(),
+                    "raw": raw_samples.summary(),
+                    "frames": len(response.frames),
+                    "size": response.size,
+                }
+            )
+        if result.status:
+            # the device is full
+            break
+
+    benchmark_report.add(
+        "secrets_list_scaling",
+        helper_params(secretsApp, long_labels=long_labels, pws=pws),
+        steps=steps,
+    )
+
+
+def test_calculate_all_scaling(secretsAppRaw, otp_vectors, benchmark_report):
+    """
+    Register TOTP and HOTP credentials, with and without PIN-based
+    encryption, and record the latency of CalculateAll depending on the
+    number of credentials. All returned TOTP codes are checked.
+    """
+    secretsApp = secretsAppRaw
+    secretsApp.reset()
+    secretsApp.set_pin_raw(PIN)
+    if not helper_calculate_all_supported(secretsApp):
+        pytest.skip("CalculateAll is not supported")
+
+    expected = {}
+    steps = []
+    for count in CALCULATE_ALL_COUNTS:
+        for i in range(len(expected), count):
+            name = helper_label(i, False)
+            kind = Kind.Hotp if i % 3 == 2 else Kind.Totp
+            secretsApp.verify_pin_raw(PIN)
+            secretsApp.register(
+                name,
+                SECRET,
+                DIGITS,
+                kind=kind,
+                pin_based_encryption=i % 2 == 1,
+            )
+            expected[name] = kind
+
+        samples = Samples()
+        for challenge in range(ROUNDS // 4):
+            secretsApp.verify_pin_raw(PIN)
+            with samples.measure():
+                codes = calculate_all(secretsApp, challenge)
+            assert codes.keys() == expected.keys()
+            for name, kind in expected.items():
+                if kind == Kind.Totp:
+                    assert codes[name] == otp_vectors.hotp(SECRET, challenge)
+                else:
+                    assert codes[name] is None
+
+        summary = samples.summary()
+        steps.append(
+            {
+                "count": count,
+                "latency": summary,
+                "per_credential": summary["p50"] / count,
+            }
+        )
+
+    benchmark_report.add("secrets_calculate_all", {}, steps=steps)
+
+
+def helper_pws_fields(i: int) -> dict:
+    size = PWS_FIELD_SIZES[i % len(PWS_FIELD_SIZES)]
+    return dict(
+        login=b"login".center(size, b"="),
+        password=b"password".center(size, b"="),
+        metadata=b"metadata".center(size, b"="),
+    )
+
+
+@pytest.mark.slow
+def test_password_safe_scaling(secretsAppResetLogin, benchmark_report):
+    """
+    Fill the device step by step with Password Safe entries with fields of
+    different sizes, and record the latency of reading, updating and
+    renaming entries, up to a nearly full filesystem.
+    """
+    secretsApp = secretsAppResetLogin
+    registered = []
+    steps = []
+    for count in SCALING_COUNTS:
+        result = bulk_register(
+            secretsApp,
+            [
+                dict(credid=helper_label(i, False), **helper_pws_fields(i))
+                for i in range(len(registered), count)
+            ],
+            PIN,
+        )
+        registered += result.registered
+        assert registered, "Could not register any credential"
+
+        get = Samples()
+        update = Samples()
+        rename = Samples()
+        failures = 0
+        for i in range(ROUNDS // 4):
+            index = i * (len(registered) - 1) // max(ROUNDS // 4 - 1, 1)
+            name = registered[index]
+            fields = helper_pws_fields(index + 1)
+            try:
+                secretsApp.verify_pin_raw(PIN)
+                with get.measure():
+                    secretsApp.get_credential(name)
+                secretsApp.verify_pin_raw(PIN)
+                with update.measure():
+                    secretsApp.update_credential(name, **fields)
+                secretsApp.verify_pin_raw(PIN)
+                with rename.measure():
+                    secretsApp.rename_credential(name, name + b"R")
+                secretsApp.verify_pin_raw(PIN)
+                secretsApp.rename_credential(name + b"R", name)
+            except SecretsAppException:
+                failures += 1
+
+        steps.append(
+            {
+                "count": len(registered),
+                "full": result.status is not None,
+                "get_credential": get.summary(),
+                "update_credential": update.summary(),
+                "rename_credential": rename.summary(),
+                "failures": failures,
+            }
+        )
+        if result.status:
+            break
+
+    benchmark_report.add(
+        "secrets_password_safe", helper_params(secretsApp), steps=steps
+    )
+
+
+def test_hmac_challenge_response(secretsAppRaw, benchmark_report):
+    """
+    Configure both HMAC slots, and record the latency of the KeepassXC
+    challenge-response operation for different challenge lengths. All
+    responses are checked against a local HMAC calculation.
+    """
+    secretsApp = secretsAppRaw
+    secretsApp.reset()
+    secrets = {}
+    for i, slot_name in enumerate(YK_HMAC_SLOTS):
+        secrets[slot_name] = bytes([i + 1]) * 20
+        secretsApp.register(
+            slot_name, secret=secrets[slot_name], kind=Kind.Hmac
+        )
+
+    latency = {}
+    for slot_name, slot in YK_HMAC_SLOTS.items():
+        for length in HMAC_CHALLENGE_LENGTHS:
+            samples = Samples()
+            for i in range(ROUNDS):
+                challenge = (b"%d-" % i * length)[:length]
+                challenge_padded = get_padded(challenge)
+                with samples.measure():
+                    _, response = send_receive_ins(
+                        secretsApp,
+                        YK_API_REQ,
+                        p1=slot,
+                        le=20,
+                        data_raw=challenge_padded,
+                    )
+                assert response == secretsApp.get_response_for_secret(
+                    challenge, secrets[slot_name]
+                )
+            latency[f"{slot_name.decode()}-{length}"] = samples.summary()
+
+    benchmark_report.add("secrets_hmac", {}, latency=latency)
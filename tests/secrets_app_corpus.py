@@ -0,0 +1,126 @@
+"""
+Tools for the fuzzing corpus of the Secrets application.
+Requires an USB-IP simulation.
+"""
+
+import copy
+
+import pytest
+
+from pynitrokey.nk3.device import Nitrokey3Device
+from pynitrokey.nk3.secrets_app import SecretsApp
+from utils.corpus import (
+    Corpus, CorpusInput, CorpusWriter, decode_records, encode_records,
+    minimize
+)
+from utils.device import UsbipDevice
+from utils.fuzz import Fuzzer
+
+
+def test_corpus_input_copy(tmp_path):
+    """
+    The secretsApp fixture uses a deep copy of the client, so the commands
+    sent with the copy have to be added to the corpus input of the test.
+    """
+    corpus_input = CorpusInput("test")
+    app = SecretsApp(None)
+    app.write_corpus_fn = corpus_input
+    app_copy = copy.deepcopy(app)
+    assert app_copy.write_corpus_fn is corpus_input
+    app_copy.write_corpus_fn(None, b"\x00\xa4\x04\x00")
+    app_copy.write_corpus_fn(None, b"\x00" * 256)
+    app_copy.write_corpus_fn(None, b"\x00" * 0x10000)
+
+    corpus_path = str(tmp_path / "corpus")
+    with CorpusWriter(corpus_path) as writer:
+        assert writer.add(corpus_input.name, corpus_input.records)
+    assert writer.dropped_records == 1
+    assert list(Corpus(corpus_path)) == [[b"\x00\xa4\x04\x00", b"\x00" * 256]]
+    # only the input file is stored in the corpus directory
+    (path,) = (tmp_path / "corpus").iterdir()
+    assert path.read_bytes() == (
+        b"\x04\x00\xa4\x04\x00" + b"\xff\x01\x00" + b"\x00" * 256
+    )
+
+
+@pytest.mark.parametrize("length", [0, 1, 254, 255, 256, 0xFFFF])
+def test_corpus_records(length):
+    """
+    Records of all lengths up to MAX_RECORD are encoded and decoded again,
+    with a single length byte for records shorter than 255 bytes.
+    """
+    records = [b"\x01" * length, b"\x00\xa4\x04\x00"]
+    data = encode_records(records)
+    assert decode_records(data) == records
+    assert len(data) == len(records[0]) + (1 if length < 255 else 3) + 5
+
+
+@pytest.mark.skipif(
+    "not config.getoption('generate_fuzzing_corpus')",
+    reason="--generate-fuzzing-corpus not set",
+)
+def test_corpus_input(secretsApp, corpus_func):
+    """
+    Check that the commands of a test using the secretsApp fixture are
+    collected for the corpus.
+    """
+    secretsApp.reset()
+    assert corpus_func.records
+
+
+@pytest.mark.virtual
+@pytest.mark.skipif(
+    "not config.getoption('minimize_corpus')",
+    reason="--minimize-corpus not set",
+)
+def test_minimize(request, device):
+    """
+    Execute every input of the corpus on a reset Secrets App, cluster the
+    inputs by the instructions, status words and response shapes and keep
+    the smallest input of every cluster.
+    """
+    corpus_path = str(request.config.getoption("--fuzzing-corpus-path"))
+    output = request.config.getoption("--minimize-corpus")
+    assert output != corpus_path, "the minimized corpus needs a new directory"
+    corpus = Corpus(corpus_path)
+    if not len(corpus):
+        pytest.skip(f"No corpus pack found in {corpus_path}")
+
+    nk3 = Nitrokey3Device.open(f"/dev/{device.hidraw}")
+    assert nk3
+    try:
+        app = SecretsApp(nk3)
+        result = minimize(nk3, corpus, app.reset)
+    finally:
+        nk3.close()
+    result.write(output)
+
+    stats = result.stats()
+    print(
+        f"Minimized {stats['inputs']} inputs ({stats['size']} B) to "
+        f"{stats['clusters']} inputs ({stats['minimized_size']} B)"
+    )
+
+
+@pytest.mark.virtual
+@pytest.mark.skipif("not config.getoption('fuzz')", reason="--fuzz not set")
+def test_fuzz(request, device):
+    """
+    Send mutated corpus inputs to the Secrets App for the configured time and
+    fail if the runner crashed or hung.
+    """
+    assert isinstance(device, UsbipDevice)
+    corpus_path = str(request.config.getoption("--fuzzing-corpus-path"))
+    corpus = list(Corpus(corpus_path))
+    if not corpus:
+        pytest.skip(f"No corpus pack found in {corpus_path}")
+
+    crash_path = request.config.getoption("--fuzz-crash-path")
+    fuzzer = Fuzzer(device, corpus, crash_path)
+    stats = fuzzer.run(request.config.getoption("--fuzz"))
+    print(
+        f"{stats.executions} executions "
+        f"({stats.executions_per_second:.1f}/s), "
+        f"{stats.crashes} crashes, {stats.hangs} hangs"
+    )
+    assert not fuzzer.crashing_inputs, f"failing inputs in {crash_path}"
@@ -0,0 +1,90 @@
+"""
+Replay of recorded APDU traces against the Secrets application.
+Record a trace with --record-apdu-trace and replay it against another
+firmware build with --replay-apdu-trace.  The trace has to start with a
+reset of the Secrets App, for example by recording the Secrets App tests.
+"""
+
+import pytest
+
+from pynitrokey.trussed.device import App
+from utils.recorder import Exchange, read_trace, replay
+
+SELECT_REQUEST = bytes.fromhex("00a4040007a0000005272101")
+
+
+def helper_select_response(salt, challenge, pin_counter=8):
+    return bytes.fromhex("9000") + bytes.fromhex(
+        "7903040d00"
+        f"7108{salt}"
+        f"7408{challenge}"
+        "7b0101"
+        f"8201{pin_counter:02x}"
+        "8f0412345678"
+    )
+
+
+class ReplayDevice:
+    def __init__(self, responses):
+        self.responses = responses
+
+    def _call_app(self, app, response_len=None, data=b""):
+        return self.responses.pop(0)
+
+
+def test_replay_select():
+    """
+    The version, salt, challenge and serial number in the Select response
+    may differ from the recording, the other values may not.
+    """
+    recorded = Exchange(
+        0.0, 0.001, App.SECRETS.value, SELECT_REQUEST,
+        helper_select_response("0011223344556677", "8899aabbccddeeff"),
+    )
+    dev = ReplayDevice([
+        helper_select_response("1011121314151617", "18191a1b1c1d1e1f"),
+        helper_select_response(
+            "2021222324252627", "28292a2b2c2d2e2f", pin_counter=7
+        ),
+        bytes.fromhex("6982"),
+    ])
+    result = replay(dev, [recorded] * 3)
+    assert [m.index for m in result.mismatches] == [1, 2]
+    assert len(result.replayed["Select"]) == 3
+
+
+@pytest.mark.skipif(
+    "not config.getoption('replay_apdu_trace')",
+    reason="--replay-apdu-trace not set",
+)
+def test_replay(request, dev, benchmark_report):
+    """
+    Send the recorded requests as fast as possible, and compare the responses
+    and the latency per instruction with the recording.
+    """
+    path = request.config.getoption("--replay-apdu-trace")
+    result = replay(dev, read_trace(path))
+
+    shifts = result.latency_shifts()
+    for name, shift in shifts.items():
+        print(
+            f"{name:>16}: {shift['recorded'] * 1000:8.2f} ms -> "
+            f"{shift['replayed'] * 1000:8.2f} ms ({shift['ratio']:.2f}x)"
+        )
+    benchmark_report.add(
+        "secrets_replay",
+        {"trace": path},
+        exchanges=sum(len(s) for s in result.replayed.values()),
+        mismatches=len(result.mismatches),
+        latency=shifts,
+    )
+
+    for m in result.mismatches[:10]:
+        print(
+            f"#{m.index} {m.expected.name}: "
+            f"expected {m.expected.response.hex()}, got {m.response.hex()}"
+        )
+    assert not result.mismatches, (
+        f"{len(result.mismatches)} responses differ from the recording, "
+        f"first at #{result.mismatches[0].index}"
+    )
@@ -5,7 +5,6 @@ Requires a live device, or an USB-IP simulation.
 
 import binascii
 import datetime
-import hashlib
 import hmac
 import logging
 import time
@@ -13,7 +12,7 @@ from contextlib import suppress
 from datetime import timedelta
 from os import environ, wait
 from sys import stderr
-from typing import Any, Callable, List, Optional, Tuple
+from typing import Any, Callable
 
 import fido2
 import pytest
@@ -48,6 +47,14 @@ from pynitrokey.nk3.secrets_app import (
     Tag,
 )
 from pynitrokey.trussed.device import App
+from utils.secrets import (
+    YK_API_REQ,
+    YK_P1_CMD_HMAC_1,
+    YK_P1_CMD_HMAC_2,
+    bulk_register,
+    get_padded,
+    send_receive_ins,
+)
 
 CREDENTIAL_LABEL_MAX_SIZE = 127
 pytestmark = pytest.mark.full
@@ -67,30 +74,30 @@ def test_list(secretsAppResetLogin):
     secretsAppResetLogin.list()
 
 
-def test_register(secretsAppResetLogin):
+def test_register(secretsAppNamespace):
     """
     Register credential with the given id and properties. Simple test.
     """
-    secretsAppResetLogin.register(CREDID, SECRET, DIGITS, kind=Kind.Hotp)
+    secretsAppNamespace.register(CREDID, SECRET, DIGITS, kind=Kind.Hotp)
 
 
-def test_calculate(secretsAppResetLogin):
+def test_calculate(secretsAppNamespace):
     """
     Run calculation on the default credential id. Simple test.
     """
-    secretsAppResetLogin.register(CREDID, SECRET, DIGITS, kind=Kind.Hotp)
-    secretsAppResetLogin.verify_pin_raw(PIN)
-    code = secretsAppResetLogin.calculate(CREDID, CHALLENGE)
+    secretsAppNamespace.register(CREDID, SECRET, DIGITS, kind=Kind.Hotp)
+    secretsAppNamespace.verify_pin_raw(PIN)
+    code = secretsAppNamespace.calculate(CREDID, CHALLENGE)
     print(code)
 
 
-def test_delete(secretsAppResetLogin):
+def test_delete(secretsAppNamespace):
     """
     Remove credential with the given id. Simple test.
     """
-    secretsAppResetLogin.register(CREDID, SECRET, DIGITS, kind=Kind.Hotp)
-    secretsAppResetLogin.verify_pin_raw(PIN)
-    secretsAppResetLogin.delete(CREDID)
+    secretsAppNamespace.register(CREDID, SECRET, DIGITS, kind=Kind.Hotp)
+    secretsAppNamespace.verify_pin_raw(PIN)
+    secretsAppNamespace.delete(CREDID)
 
 
 def test_delete_nonexisting(secretsAppResetLogin):
@@ -153,14 +160,15 @@ def test_list_changes(secretsAppResetLogin):
         0xFFFFFFFF - 10,
     ],
 )
-def test_calculated_codes_hotp(secretsAppResetLogin, secret, start_counter):
+def test_calculated_codes_hotp(
+    secretsAppNamespace, otp_vectors, secret, start_counter
+):
     """
-    Test HOTP codes against another OTP library.
+    Test HOTP codes against host-side reference vectors.
     Use different secret and start counter values.
     """
-    oath = pytest.importorskip("oath")
     secretb = binascii.a2b_hex(secret)
-    secretsApp = secretsAppResetLogin
+    secretsApp = secretsAppNamespace
     secretsApp.register(
         CREDID,
         secretb,
@@ -169,7 +177,7 @@ def test_calculated_codes_hotp(secretsAppResetLogin, secret, start_counter):
         algo=Algorithm.Sha1,
         initial_counter_value=start_counter,
     )
-    lib_at = lambda t: oath.hotp(secret, counter=t, format="dec6").encode()
+    lib_at = lambda t: otp_vectors.hotp(secretb, t)
     for i in range(10):
         i = i + start_counter
         secretsApp.verify_pin_raw(PIN)
@@ -185,21 +193,20 @@ def test_calculated_codes_hotp(secretsAppResetLogin, secret, start_counter):
         "002EF43F51AFA97BA2B46418768123C9E1809A5B" * 2,
     ],
 )
-def test_calculated_codes_totp(secretsAppResetLogin, secret):
+def test_calculated_codes_totp(secretsAppNamespace, otp_vectors, secret):
     """
-    Test TOTP codes against another OTP library.
+    Test TOTP codes against host-side reference vectors.
     """
-    oath = pytest.importorskip("oath")
     secretb = binascii.a2b_hex(secret)
-    secretsApp = secretsAppResetLogin
+    secretsApp = secretsAppNamespace
     secretsApp.register(CREDID, secretb, digits=6, kind=Kind.Totp, algo=Algorithm.Sha1)
-    lib_at = lambda t: oath.totp(secret, format="dec6", period=30, t=t * 30).encode()
+    lib_at = lambda t: otp_vectors.totp(secretb, t * 30)
     for i in range(10):
         secretsApp.verify_pin_raw(PIN)
         assert secretsApp.calculate(CREDID, i) == lib_at(i)
 
 
-def test_calculated_codes_test_vector(secretsAppResetLogin):
+def test_calculated_codes_test_vector(secretsAppNamespace):
     """
     Check output against RFC4226 test vectors, as provided in
     https://www.rfc-editor.org/rfc/rfc4226#page-32
@@ -221,7 +228,7 @@ def test_calculated_codes_test_vector(secretsAppResetLogin):
        9        2679dc69        645520489     520489"""
     # select last column only, starting after the header line
     codes = [x.split()[-1].encode() for x in test_vectors.splitlines()[2:]]
-    secretsApp = secretsAppResetLogin
+    secretsApp = secretsAppNamespace
 
     secretsApp.register(CREDID, secretb, digits=6, kind=Kind.Hotp, algo=Algorithm.Sha1)
     for i in range(10):
@@ -229,7 +236,7 @@ def test_calculated_codes_test_vector(secretsAppResetLogin):
         assert secretsApp.calculate(CREDID, i) == codes[i]
 
 
-def test_reverse_hotp_vectors(secretsAppResetLogin):
+def test_reverse_hotp_vectors(secretsAppNamespace):
     """
     Test passing conditions for the HOTP reverse check
     Check against RFC4226 test vectors, as provided in
@@ -253,7 +260,7 @@ def test_reverse_hotp_vectors(secretsAppResetLogin):
     # select last column only, starting after the header line
     codes = [x.split()[-1].encode() for x in test_vectors.splitlines()[2:]]
 
-    secretsApp = secretsAppResetLogin
+    secretsApp = secretsAppNamespace
     secretsApp.register(
         CREDID, secretb, digits=6, kind=Kind.HotpReverse, algo=Algorithm.Sha1
     )
@@ -322,7 +329,7 @@ def helper_wait_after_failed_hotp_verification_request():
     "offset",
     [0, 1, HOTP_WINDOW_SIZE - 1, HOTP_WINDOW_SIZE, HOTP_WINDOW_SIZE + 1],
 )
-def test_reverse_hotp_window(secretsAppResetLogin, offset, start_value):
+def test_reverse_hotp_window(secretsAppNamespace, otp_vectors, offset, start_value):
     """
     Test reverse HOTP code calculation synchronization.
     Solution contains a means to avoid desynchronization between the host's and device's counters. Device calculates
@@ -338,10 +345,9 @@ def test_reverse_hotp_window(secretsAppResetLogin, offset, start_value):
     will be greater or equal to 10.
     See https://github.com/Nitrokey/nitrokey-hotp-verification#verifying-hotp-code for more information.
     """
-    oath = pytest.importorskip("oath")
     secret = "3132333435363738393031323334353637383930"
     secretb = binascii.a2b_hex(secret)
-    secretsApp = secretsAppResetLogin
+    secretsApp = secretsAppNamespace
     secretsApp.register(
         CREDID,
         secretb,
@@ -350,7 +356,7 @@ def test_reverse_hotp_window(secretsAppResetLogin, offset, start_value):
         algo=Algorithm.Sha1,
         initial_counter_value=start_value,
     )
-    lib_at = lambda t: oath.hotp(secret, counter=t, format="dec6").encode()
+    lib_at = lambda t: otp_vectors.hotp(secretb, t)
     code_to_send = lib_at(start_value + offset)
     code_to_send = int(code_to_send)
     if offset > HOTP_WINDOW_SIZE:
@@ -373,14 +379,14 @@ def test_reverse_hotp_window(secretsAppResetLogin, offset, start_value):
                 SecretsAppException,
                 match="UnspecifiedPersistentExecutionError|VerificationFailed",
             ):
-                secretsAppResetLogin.verify_pin_raw(PIN)
+                secretsAppNamespace.verify_pin_raw(PIN)
                 # send the same code once again - should be rejected
                 secretsApp.verify_code(CREDID, code_to_send)
             helper_wait_after_failed_hotp_verification_request()
             # test the very next value - should be accepted
             code_to_send = lib_at(start_value + offset + 1)
             code_to_send = int(code_to_send)
-            secretsAppResetLogin.verify_pin_raw(PIN)
+            secretsAppNamespace.verify_pin_raw(PIN)
             assert secretsApp.verify_code(CREDID, code_to_send)
         else:
             # counter got saturated, error code will be returned
@@ -388,7 +394,7 @@ def test_reverse_hotp_window(secretsAppResetLogin, offset, start_value):
                 with pytest.raises(
                     SecretsAppException, match="UnspecifiedPersistentExecutionError"
                 ):
-                    secretsAppResetLogin.verify_pin_raw(PIN)
+                    secretsAppNamespace.verify_pin_raw(PIN)
                     secretsApp.verify_code(CREDID, code_to_send)
                 helper_wait_after_failed_hotp_verification_request()
 
@@ -400,9 +406,9 @@ def test_reverse_hotp_window(secretsAppResetLogin, offset, start_value):
 @pytest.mark.parametrize(
     "algorithm",
     [
-        (Algorithm.Sha1, hashlib.sha1),
-        (Algorithm.Sha256, hashlib.sha256),
-        # (Algorithm.Sha512, hashlib.sha512),  # unsupported by the OTP App in the firmware
+        (Algorithm.Sha1, "sha1"),
+        (Algorithm.Sha256, "sha256"),
+        # (Algorithm.Sha512, "sha512"),  # unsupported by the OTP App in the firmware
     ],
 )
 @pytest.mark.parametrize(
@@ -413,20 +419,17 @@ def test_reverse_hotp_window(secretsAppResetLogin, offset, start_value):
     ],
 )
 def test_calculated_codes_totp_hash_digits(
-    secretsAppResetLogin, secret, algorithm, digits
+    secretsAppNamespace, otp_vectors, secret, algorithm, digits
 ):
     """
-    Test TOTP codes against another OTP library, with different hash algorithms and digits count.
+    Test TOTP codes against host-side reference vectors, with different hash algorithms and digits count.
     Test vector secret, and a random 40 bytes value.
     """
-    algo_app, algo_oath = algorithm
-    oath = pytest.importorskip("oath")
+    algo_app, algo_ref = algorithm
     secretb = binascii.a2b_hex(secret)
-    secretsApp = secretsAppResetLogin
+    secretsApp = secretsAppNamespace
     secretsApp.register(CREDID, secretb, digits=digits, kind=Kind.Totp, algo=algo_app)
-    lib_at = lambda t: oath.totp(
-        secret, format="dec" + str(digits), period=30, t=t * 30, hash=algo_oath
-    ).encode()
+    lib_at = lambda t: otp_vectors.totp(secretb, t * 30, digits, algo_ref)
     for i in range(10):
         secretsApp.verify_pin_raw(PIN)
         assert secretsApp.calculate(CREDID, i) == lib_at(i)
@@ -448,44 +451,43 @@ def test_calculated_codes_totp_hash_digits(
         pytest.param(1000, marks=pytest.mark.slow),
     ],
 )
-def test_load(secretsAppResetLogin, kind: Kind, long_labels: str, count):
+def test_load(secretsAppResetLogin, otp_vectors, kind: Kind, long_labels: str, count):
     """
     Load tests to see how much OTP credentials we can store,
     and if using of them is not broken with the full FS.
     """
     secret = "3132333435363738393031323334353637383930"
-    oath = pytest.importorskip("oath")
     secretb = binascii.a2b_hex(secret)
 
     secretsApp = secretsAppResetLogin
-    credentials_registered: int = 0
-    names_registered: List[bytes] = []
 
     name_gen: Callable[[int], str] = lambda x: f"LOAD{x:02}"
     if long_labels == "long_labels":
         name_gen = lambda x: (f"LOAD{x:02}" * 100)[:CREDENTIAL_LABEL_MAX_SIZE]
 
-    i = 0
-    while True:
-        name = name_gen(i)
-        try:
-            secretsApp.verify_pin_raw(PIN)
-            secretsApp.register(
-                name.encode(), secretb, digits=6, kind=kind, initial_counter_value=i
+    # Register up to count + 2 credentials, stop early if the FS is full
+    result = bulk_register(
+        secretsApp,
+        [
+            dict(
+                credid=name_gen(i).encode(),
+                secret=secretb,
+                digits=6,
+                kind=kind,
+                initial_counter_value=i,
             )
-            names_registered.append(name.encode())
-            if i > count:
-                i = i + 1
-                raise Exception("Reached expected credentials count, finishing early")
-        except Exception as e:
-            print(f"{e}")
-            print(f"Registered {i} credentials")
-            size = len(secret) + len(name)
-            print(f"Single Credential size: {size} B")
-            print(f"Total size: {size * i} B")
-            credentials_registered = i
-            break
-        i += 1
+            for i in range(count + 2)
+        ],
+        PIN,
+    )
+    names_registered = result.registered
+    credentials_registered = len(names_registered)
+    if result.status:
+        print(f"Registration failed with status {result.status.hex()}")
+    print(f"Registered {credentials_registered} credentials")
+    size = len(secret) + len(name_gen(0))
+    print(f"Single Credential size: {size} B")
+    print(f"Total size: {size * credentials_registered} B")
 
     assert (
         credentials_registered > 30
@@ -507,9 +509,8 @@ def test_load(secretsAppResetLogin, kind: Kind, long_labels: str, count):
     l = secretsApp.list()
     assert len(l) == credentials_registered
 
-    lib_at = lambda t: oath.totp(secret, format="dec6", period=30, t=t * 30).encode()
-    if kind == Kind.Hotp:
-        lib_at = lambda t: oath.hotp(secret, format="dec6", counter=t).encode()
+    # the TOTP challenge is given in periods, so it equals the HOTP counter
+    lib_at = lambda t: otp_vectors.hotp(secretb, t)
 
     for i in range(credentials_registered):
         # At this point device should respond to our calls, despite being full, fail otherwise
@@ -789,40 +790,6 @@ def test_set_code_and_validate(secretsAppRaw, remove_password_with: Instruction)
     assert state.challenge is None
 
 
-@pytest.mark.skip(reason="This test takes long time")
-def test_revhotp_bruteforce(secretsAppNoLog):
-    """
-    This test implements practical brute-forcing of the codes values.
-    In case multiple devices use the same secret, stealing and brute-forcing answers on one
-    could help with the other.
-    """
-    secretsApp = secretsAppNoLog
-    secretsApp.reset()
-    secretsApp.register(
-        CREDID, SECRET, digits=6, kind=Kind.HotpReverse, algo=Algorithm.Sha1
-    )
-    start_time = time.time()
-    code_start = 1_000_000
-
-    from tqdm import tqdm, trange
-
-    for current_code in trange(code_start, 0, -1):
-        tqdm.write(f"Trying code {current_code}")
-        try:
-            secretsApp.verify_code(CREDID, current_code)
-            stop_time = time.time()
-            tqdm.write(
-                f"Found code {current_code} after {stop_time - start_time} seconds"
-            )
-            break
-        except KeyboardInterrupt:
-            break
-        except fido2.ctap.CtapError:
-            pass
-        except Exception:
-            break
-
-
 @pytest.mark.skipif(
     FEATURE_BRUTEFORCE_PROTECTION_ENABLED == False,
     reason="Brute-force protection feature should be activated",
@@ -902,18 +869,16 @@ def test_change_pin(secretsApp):
     assert secretsApp.select().pin_attempt_counter == PIN_ATTEMPT_COUNTER_DEFAULT - 1
 
 
-def test_change_pin_data_dont_change(secretsAppResetLogin):
+def test_change_pin_data_dont_change(secretsAppResetLogin, otp_vectors):
     """
     Test for changing the proper PIN on the device.
     Check if data remain the same, both PIN and Hardware key encrypted
     """
 
     def helper_test_calculated_codes_totp(secretsApp, secret: str, PIN: str):
-        """Test TOTP codes against another OTP library."""
-        oath = pytest.importorskip("oath")
-        lib_at = lambda t: oath.totp(
-            secret, format="dec6", period=30, t=t * 30
-        ).encode()
+        """Test TOTP codes against host-side reference vectors."""
+        secretb = binascii.a2b_hex(secret)
+        lib_at = lambda t: otp_vectors.totp(secretb, t * 30)
         for i in range(10):
             # Use non-modified verify_pin_raw_always call to always verify PIN, regardless of the fixture type
             secretsApp.verify_pin_raw_always(PIN)
@@ -1190,50 +1155,6 @@ def test_credential_encryption_does_not_change(secretsAppRaw):
     assert not secretsAppRaw.list()
 
 
-def helper_send_receive_ins(
-    app: SecretsApp,
-    ins,
-    structure=None,
-    p1=None,
-    le=None,
-    data_raw: bytes = b"",
-    expected_SW: Optional[str] = "9000",
-) -> Tuple[bytes, bytes]:
-    """
-    Helper for direct communication with the device
-    Send data directly to the CTAP bridge.
-    @param app: App
-    @param ins: CCID Ins; if sent as int, it is used verbatim, otherwise will be encoded as default
-    @param structure: a list of TLV entries to encode
-    @param p1: CCID P1 parameter to be called; if not provided, a default for given Ins will be used
-    @param le: CCID Le
-    @param data_raw: Raw CCID data field to send; used, when structure is None
-    @param expected_SW: expected SW code, which is checked before returning
-    """
-
-    def _trunc(s: str, l: int = 100) -> str:
-        return f"{s[:l]}.." if len(s) > l else s
-
-    from pynitrokey.start.gnuk_token import iso7816_compose
-
-    p2 = 0
-    p1 = 0 if p1 is None else p1
-    if isinstance(ins, int):
-        ins_b = ins
-    else:
-        ins_b, p1, p2 = app._encode_command(ins)
-    data_to_send = app._custom_encode(structure) if structure is not None else data_raw
-    data = iso7816_compose(ins_b, p1, p2, data_to_send, le=le)
-    app.logfn(f">> {_trunc(data.hex())}")
-    res = app.dev._call_app(App.SECRETS, data=data)
-    app.logfn(f"<< {_trunc(res.hex())}")
-    status_bytes, result = res[:2], res[2:]
-
-    if expected_SW:
-        assert status_bytes.hex() == expected_SW
-    return status_bytes, result
-
-
 def test_send_remaining(secretsApp):
     secrets_app = secretsApp
     secrets_app.reset()
@@ -1260,14 +1181,14 @@ def test_send_remaining(secretsApp):
 
     # Run PIN verification so all Credentials on List command will be visible
     secrets_app.verify_pin_raw(PIN)
-    status_bytes, result = helper_send_receive_ins(
+    status_bytes, result = send_receive_ins(
         secrets_app, Instruction.List, expected_SW=None
     )
     # Make sure there are remaining data to receive
     MORE_DATA_STATUS_BYTE = 0x61
     assert status_bytes[0] == MORE_DATA_STATUS_BYTE
     # Call a different command now, like Delete, which should not add any new data to the buffer
-    status_bytes, result = helper_send_receive_ins(
+    status_bytes, result = send_receive_ins(
         secrets_app,
         Instruction.Delete,
         structure=[
@@ -1291,12 +1212,13 @@ def test_send_remaining(secretsApp):
         128 - 1,
     ],
 )
-def test_password_safe(secretsAppResetLogin: SecretsApp, length: int) -> None:
+def test_password_safe(
+    secretsAppResetLogin: SecretsApp, otp_vectors, length: int
+) -> None:
     """
     Create a full credential, with both OTP and PWS fields populated. Test working both, with and without PIN-based encryption.
     """
     secretsApp = secretsAppResetLogin
-    oath = pytest.importorskip("oath")
     login = b"login".center(length, b"=")
     password = b"password".center(length, b"=")
     metadata = b"metadata".center(length, b"=")
@@ -1312,9 +1234,7 @@ def test_password_safe(secretsAppResetLogin: SecretsApp, length: int) -> None:
         password=password,
         metadata=metadata,
     )
-    lib_at = lambda t: oath.totp(
-        SECRET.decode(), format="dec6", period=30, t=t * 30
-    ).encode()
+    lib_at = lambda t: otp_vectors.totp(secretb, t * 30)
     for i in range(10):
         secretsApp.verify_pin_raw(PIN)
         assert secretsApp.calculate(name, i) == lib_at(i)
@@ -1327,29 +1247,29 @@ def test_password_safe(secretsAppResetLogin: SecretsApp, length: int) -> None:
     assert p.metadata == metadata
 
 
-def test_password_safe_empty_credential(secretsAppResetLogin):
+def test_password_safe_empty_credential(secretsAppNamespace):
     """
     It should be possible to create an empty credential, with just the name presented
     """
-    secretsAppResetLogin.verify_pin_raw(PIN)
-    secretsAppResetLogin.register(CREDID)
+    secretsAppNamespace.verify_pin_raw(PIN)
+    secretsAppNamespace.register(CREDID)
 
     with pytest.raises(SecretsAppException, match="ConditionsOfUseNotSatisfied"):
-        secretsAppResetLogin.verify_pin_raw(PIN)
-        secretsAppResetLogin.calculate(CREDID, 0)
+        secretsAppNamespace.verify_pin_raw(PIN)
+        secretsAppNamespace.calculate(CREDID, 0)
 
-    secretsAppResetLogin.verify_pin_raw(PIN)
-    p = secretsAppResetLogin.get_credential(CREDID)
+    secretsAppNamespace.verify_pin_raw(PIN)
+    p = secretsAppNamespace.get_credential(CREDID)
     assert p.name == CREDID.encode()
     assert p.login is None
     assert p.password is None
     assert p.metadata is None
 
-    secretsAppResetLogin.verify_pin_raw(PIN)
-    assert CREDID.encode() in secretsAppResetLogin.list()
+    secretsAppNamespace.verify_pin_raw(PIN)
+    assert CREDID.encode() in secretsAppNamespace.list()
 
 
-def test_password_safe_just_pws_entry(secretsAppResetLogin):
+def test_password_safe_just_pws_entry(secretsAppNamespace):
     """
     It should be possible to create a PWS-only credential
     """
@@ -1358,31 +1278,31 @@ def test_password_safe_just_pws_entry(secretsAppResetLogin):
     password = b"password".center(length, b"=")
     metadata = b"metadata".center(length, b"=")
 
-    secretsAppResetLogin.verify_pin_raw(PIN)
-    secretsAppResetLogin.register(
+    secretsAppNamespace.verify_pin_raw(PIN)
+    secretsAppNamespace.register(
         CREDID, login=login, password=password, metadata=metadata
     )
 
     # Since OTP details were not specified, calling Calculate on it should fail
-    secretsAppResetLogin.verify_pin_raw(PIN)
+    secretsAppNamespace.verify_pin_raw(PIN)
     with pytest.raises(SecretsAppException, match="ConditionsOfUseNotSatisfied"):
-        secretsAppResetLogin.calculate(CREDID, 0)
+        secretsAppNamespace.calculate(CREDID, 0)
 
     # Reverse HOTP is rejecting that too
-    secretsAppResetLogin.verify_pin_raw(PIN)
+    secretsAppNamespace.verify_pin_raw(PIN)
     with pytest.raises(SecretsAppException, match="ConditionsOfUseNotSatisfied"):
-        secretsAppResetLogin.verify_code(CREDID, 0)
+        secretsAppNamespace.verify_code(CREDID, 0)
 
     # Let's check what is the content of the credential
-    secretsAppResetLogin.verify_pin_raw(PIN)
-    p = secretsAppResetLogin.get_credential(CREDID)
+    secretsAppNamespace.verify_pin_raw(PIN)
+    p = secretsAppNamespace.get_credential(CREDID)
     assert p.name == CREDID.encode()
     assert p.login == login
     assert p.password == password
     assert p.metadata == metadata
 
-    secretsAppResetLogin.verify_pin_raw(PIN)
-    assert CREDID.encode() in secretsAppResetLogin.list()
+    secretsAppNamespace.verify_pin_raw(PIN)
+    assert CREDID.encode() in secretsAppNamespace.list()
 
 
 def test_select_applet(secretsAppRaw):
@@ -1398,19 +1318,6 @@ def test_select_applet(secretsAppRaw):
     print(res.hex())
 
 
-def helper_get_padded(challenge: bytes, l: int = 64) -> bytes:
-    """
-    Get PKCS#7 padded buffer
-    """
-    from cryptography.hazmat.primitives import padding
-
-    # The value passed here is in bits
-    padder = padding.PKCS7(l * 8).padder()
-    challenge_padded = padder.update(challenge)
-    challenge_padded += padder.finalize()
-    return challenge_padded
-
-
 def test_hmac_low_level(secretsAppRaw):
     """
     Test HMAC Challenge setup and use, for KeepassXC support.
@@ -1420,14 +1327,13 @@ def test_hmac_low_level(secretsAppRaw):
 
     # getting version through status call works
     YK_STATUS = 0x03
-    status, data = helper_send_receive_ins(secretsAppRaw, YK_STATUS, le=6)
+    status, data = send_receive_ins(secretsAppRaw, YK_STATUS, le=6)
     assert len(data) == 6
     # assert data.hex()[:6] == "040b00"
 
     # getting serial number works
-    YK_API_REQ = 0x01
     YK_P1_CMD_GET_SERIAL = 0x10
-    status, data = helper_send_receive_ins(
+    status, data = send_receive_ins(
         secretsAppRaw, YK_API_REQ, p1=YK_P1_CMD_GET_SERIAL, le=4
     )
     assert len(data) == 4
@@ -1435,18 +1341,15 @@ def test_hmac_low_level(secretsAppRaw):
     # test HMAC calculation calls
     secretsAppRaw.reset()
 
-    YK_P1_CMD_HMAC_1 = 0x30
-    YK_P1_CMD_HMAC_2 = 0x38
-
     # calculation on the special-named slots does not work on factory-reset state
     for slot in [YK_P1_CMD_HMAC_2, YK_P1_CMD_HMAC_1]:
-        helper_send_receive_ins(
+        send_receive_ins(
             secretsAppRaw,
             YK_API_REQ,
             p1=slot,
             le=20,
             expected_SW="6a82",
-            data_raw=helper_get_padded(b"1"),
+            data_raw=get_padded(b"1"),
         )
 
     # registration on the special-named slots works
@@ -1460,39 +1363,39 @@ def test_hmac_low_level(secretsAppRaw):
 
     for slot in [YK_P1_CMD_HMAC_2, YK_P1_CMD_HMAC_1]:
         # calculation on the hmac slot works
-        status, data = helper_send_receive_ins(
+        status, data = send_receive_ins(
             secretsAppRaw,
             YK_API_REQ,
             p1=slot,
             le=20,
-            data_raw=helper_get_padded(slot.to_bytes(1, "little") * 63),
+            data_raw=get_padded(slot.to_bytes(1, "little") * 63),
         )
         assert len(data) == 20
 
         # different input gives different output
-        status, data = helper_send_receive_ins(
+        status, data = send_receive_ins(
             secretsAppRaw,
             YK_API_REQ,
             p1=slot,
             le=20,
-            data_raw=helper_get_padded(b"1" * 63),
+            data_raw=get_padded(b"1" * 63),
         )
-        status, data2 = helper_send_receive_ins(
+        status, data2 = send_receive_ins(
             secretsAppRaw,
             YK_API_REQ,
             p1=slot,
             le=20,
-            data_raw=helper_get_padded(b"2" * 63),
+            data_raw=get_padded(b"2" * 63),
         )
         assert data != data2
 
         # same input gives same output
-        status, data3 = helper_send_receive_ins(
+        status, data3 = send_receive_ins(
             secretsAppRaw,
             YK_API_REQ,
             p1=slot,
             le=20,
-            data_raw=helper_get_padded(b"2" * 63),
+            data_raw=get_padded(b"2" * 63),
         )
         assert data3 == data2
 
@@ -1561,8 +1464,8 @@ def test_hmac_low_level(secretsAppRaw):
     # "64" should not work, as the last byte is always treated as the padding byte value.
     for challenge_len in [1, 32, 63]:
         challenge = b"c" * challenge_len
-        challenge_padded = helper_get_padded(challenge)
-        status, response_device = helper_send_receive_ins(
+        challenge_padded = get_padded(challenge)
+        status, response_device = send_receive_ins(
             secretsAppRaw,
             YK_API_REQ,
             p1=YK_P1_CMD_HMAC_2,
@@ -1711,11 +1614,11 @@ def test_register_overwrite_attempt(secretsAppRaw, cred1_encryption, cred2_encry
         )
 
 
-def test_rename_credential(secretsAppResetLogin):
+def test_rename_credential(secretsAppNamespace):
     """
     Credential should change its name. Test both PIN- and HW-encrypted credentials.
     """
-    app = secretsAppResetLogin
+    app = secretsAppNamespace
     app.register(CREDID, SECRET, DIGITS, kind=Kind.Hotp)
     app.verify_pin_raw(PIN)
     l = app.list()
@@ -1776,11 +1679,11 @@ def test_rename_credential_to_existing(
     assert set([CREDID.encode(), CREDID2.encode()]) == set(app.list())
 
 
-def test_update_credential(secretsAppResetLogin):
+def test_update_credential(secretsAppNamespace):
     """
     Credential should change its properties. Test both PIN- and HW-encrypted credentials.
     """
-    app = secretsAppResetLogin
+    app = secretsAppNamespace
     app.register(CREDID, SECRET, DIGITS, kind=Kind.Hotp)
     app.verify_pin_raw(PIN)
     l = app.list_with_properties()
@@ -4,10 +4,20 @@
 # Tests in this module may not use the device fixture!
 
 import pytest
+import random
+import string
 import tests.basic
-from utils.upgrade import ExecUpgradeTest
+from contextlib import contextmanager
+from dataclasses import asdict
+from fido2.webauthn import AttestedCredentialData
+from pynitrokey.nk3.device import Nitrokey3Device
+from pynitrokey.nk3.secrets_app import Kind, SecretsApp
+from utils.benchmark import Report
+from utils.device import Device
+from utils.fido2 import Fido2
+from utils.upgrade import ExecUpgradeTest, UpgradeTest
 from utils.ssh import SSH_KEY_TYPES
-from typing import Type
+from typing import Any, Callable, Dict, Generator, List, Type
 
 
 pytestmark = pytest.mark.skipif(
@@ -15,35 +25,133 @@ pytestmark = pytest.mark.skipif(
     reason="--upgrade not set",
 )
 
+Upgrade = Callable[[UpgradeTest[Any, Any]], None]
+
 
 @pytest.mark.parametrize("test", ExecUpgradeTest.__subclasses__())
 @pytest.mark.virtual
-def test(test: Type[ExecUpgradeTest], serial: str, ifs: str, efs: str) -> None:
-    test().run_upgrade(serial, ifs, efs)
+def test(test: Type[ExecUpgradeTest], upgrade: Upgrade) -> None:
+    upgrade(test())
 
 
 @pytest.mark.virtual
-def test_fido2(serial: str, ifs: str, efs: str) -> None:
-    tests.default.basic.TestFido2().run_upgrade(serial, ifs, efs)
+def test_fido2(upgrade: Upgrade) -> None:
+    upgrade(tests.basic.TestFido2())
 
 
 @pytest.mark.virtual
-def test_fido2_resident(serial: str, ifs: str, efs: str) -> None:
-    tests.default.basic.TestFido2Resident().run_upgrade(serial, ifs, efs)
+def test_fido2_resident(upgrade: Upgrade) -> None:
+    upgrade(tests.basic.TestFido2Resident())
 
 
 @pytest.mark.virtual
-def test_secrets(serial: str, ifs: str, efs: str) -> None:
-    tests.default.basic.TestSecrets().run_upgrade(serial, ifs, efs)
+def test_secrets(upgrade: Upgrade) -> None:
+    upgrade(tests.basic.TestSecrets())
 
 
 @pytest.mark.virtual
 @pytest.mark.parametrize("type", SSH_KEY_TYPES)
-def test_ssh(serial: str, ifs: str, efs: str, type: str) -> None:
-    tests.default.basic.TestSsh(type).run_upgrade(serial, ifs, efs)
+def test_ssh(upgrade: Upgrade, type: str) -> None:
+    upgrade(tests.basic.TestSsh(type))
 
 
 @pytest.mark.virtual
 @pytest.mark.parametrize("type", SSH_KEY_TYPES)
-def test_ssh_resident(serial: str, ifs: str, efs: str, type: str) -> None:
-    tests.default.basic.TestSshResident(type).run_upgrade(serial, ifs, efs)
+def test_ssh_resident(upgrade: Upgrade, type: str) -> None:
+    upgrade(tests.basic.TestSshResident(type))
+
+
+class TestFido2Load(UpgradeTest[Device, List[AttestedCredentialData]]):
+    __test__ = False
+
+    def __init__(self, count: int) -> None:
+        self.count = count
+        self.pin = "".join(random.choices(string.digits, k=8))
+
+    @contextmanager
+    def context(self, device: Device) -> Generator[Device, None, None]:
+        yield device
+
+    def prepare(self, device: Device) -> List[AttestedCredentialData]:
+        device.set_pin(self.pin)
+        fido2 = Fido2(device, self.pin)
+        return [
+            fido2.register(f"user{i}".encode(), f"User {i}", resident_key=True)
+            for i in range(self.count)
+        ]
+
+    def verify(
+        self, device: Device, credentials: List[AttestedCredentialData]
+    ) -> None:
+        fido2 = Fido2(device, self.pin)
+        fido2.authenticate([credentials[0]])
+        fido2.authenticate([credentials[-1]])
+
+
+class TestSecretsLoad(UpgradeTest[SecretsApp, None]):
+    __test__ = False
+
+    # RFC 4226 test secret, the code for counter 0 is 755224
+    SECRET = b"12345678901234567890"
+
+    def __init__(self, count: int) -> None:
+        self.count = count
+        self.pin = "".join(random.choices(string.digits, k=8))
+
+    @contextmanager
+    def context(self, device: Device) -> Generator[SecretsApp, None, None]:
+        nk3 = Nitrokey3Device.open(f"/dev/{device.hidraw}")
+        assert nk3
+        try:
+            yield SecretsApp(nk3)
+        finally:
+            nk3.close()
+
+    def prepare(self, app: SecretsApp) -> None:
+        app.reset()
+        app.set_pin_raw(self.pin)
+        for i in range(self.count):
+            # alternate between hardware and PIN-based encryption
+            pin_based_encryption = i % 2 == 1
+            if pin_based_encryption:
+                app.verify_pin_raw(self.pin)
+            app.register(
+                f"LOAD{i}".encode(),
+                self.SECRET,
+                kind=Kind.Hotp,
+                pin_based_encryption=pin_based_encryption,
+            )
+
+    def verify(self, app: SecretsApp, state: None) -> None:
+        app.verify_pin_raw(self.pin)
+        assert len(app.list()) == self.count
+        for i in [0, self.count - 1]:
+            app.verify_pin_raw(self.pin)
+            assert app.calculate(f"LOAD{i}".encode()) == b"755224"
+
+
+MIGRATION_TESTS: Dict[str, Callable[[], UpgradeTest[Any, Any]]] = {
+    "fido2": lambda: tests.basic.TestFido2(),
+    "fido2_resident": lambda: tests.basic.TestFido2Resident(),
+    "fido2_resident_10": lambda: TestFido2Load(10),
+    "fido2_resident_50": lambda: TestFido2Load(50),
+    "secrets": lambda: tests.basic.TestSecrets(),
+    "secrets_10": lambda: TestSecretsLoad(10),
+    "secrets_100": lambda: TestSecretsLoad(100),
+}
+
+
+@pytest.mark.virtual
+@pytest.mark.benchmark
+@pytest.mark.parametrize("name", MIGRATION_TESTS.keys())
+def test_migration(
+    name: str, serial: str, ifs: str, efs: str, benchmark_report: Report
+) -> None:
+    test = MIGRATION_TESTS[name]()
+    stats = test.measure_upgrade(serial, ifs, efs)
+    benchmark_report.add(
+        "upgrade_migration",
+        {"test": name},
+        **asdict(stats),
+        free_blocks_delta=stats.free_blocks_delta,
+    )
@@ -0,0 +1,57 @@
+"""
+Tests for the firmware bisect driver of the upgrade tests.
+They do not need a device.
+"""
+
+from contextlib import contextmanager
+from typing import Generator, Optional, Set
+
+from utils.supervisor import RunnerCrashed
+from utils.upgrade import UpgradeTest
+
+BINARIES = [f"bin/bisect/usbip-runner-{i}" for i in range(8)]
+
+
+class BisectTest(UpgradeTest[None, None]):
+    __test__ = False
+
+    def __init__(self, failing: Set[str]) -> None:
+        self.failing = failing
+
+    @contextmanager
+    def context(self, device: None) -> Generator[None, None, None]:
+        yield None
+
+    def prepare(self, context: None) -> None:
+        pass
+
+    def verify(self, context: None, state: None) -> None:
+        pass
+
+    def prepare_upgrade(self, serial: str, ifs: str, efs: str) -> None:
+        pass
+
+    def verify_upgrade(
+        self,
+        serial: str,
+        ifs: str,
+        efs: str,
+        state: None,
+        binary: Optional[str] = None,
+    ) -> None:
+        if binary in self.failing:
+            raise RunnerCrashed("exited with -11", [])
+
+
+def test_bisect_runner_crash(tmp_path):
+    """
+    A candidate whose runner crashes during the verification is a failing
+    build, and the binary search continues.
+    """
+    ifs = tmp_path / "ifs.bin"
+    efs = tmp_path / "efs.bin"
+    ifs.write_bytes(b"")
+    efs.write_bytes(b"")
+    test = BisectTest(set(BINARIES[5:]))
+    failing = test.bisect("serial", str(ifs), str(efs), BINARIES)
+    assert failing == BINARIES[5]
@@ -0,0 +1,129 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+import json
+import math
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Generator, Iterable, List, Optional, Sequence
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """
+    Returns the p-th percentile of the given values, interpolating linearly
+    between the closest ranks.
+    """
+    if not values:
+        raise ValueError("percentile of empty sequence")
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100
+    f = math.floor(k)
+    c = min(f + 1, len(s) - 1)
+    return s[f] + (s[c] - s[f]) * (k - f)
+
+
+class Samples:
+    """
+    A list of durations in seconds.
+    """
+    def __init__(self, values: Optional[Iterable[float]] = None) -> None:
+        self.values: List[float] = list(values or [])
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, value: float) -> None:
+        self.values.append(value)
+
+    @contextmanager
+    def measure(self) -> Generator[None, None, None]:
+        start = time.perf_counter()
+        yield
+        self.values.append(time.perf_counter() - start)
+
+    def summary(self) -> Dict[str, float]:
+        if not self.values:
+            return {"count": 0}
+        return {
+            "count": len(self.values),
+            "min": min(self.values),
+            "mean": sum(self.values) / len(self.values),
+            "p50": percentile(self.values, 50),
+            "p95": percentile(self.values, 95),
+            "p99": percentile(self.values, 99),
+            "max": max(self.values),
+        }
+
+
+def fill_curve(
+    latencies: Sequence[float], buckets: int = 10
+) -> List[Dict[str, float]]:
+    """
+    Splits the latencies of consecutive operations that fill up the device
+    into buckets of equal size and returns the mean latency and throughput
+    (operations per second) per bucket.  `fill` is the fraction of the
+    operations completed at the end of the bucket.
+    """
+    curve = []
+    n = len(latencies)
+    for i in range(buckets):
+        bucket = latencies[i * n // buckets:(i + 1) * n // buckets]
+        if not bucket:
+            continue
+        mean = sum(bucket) / len(bucket)
+        curve.append({
+            "fill": (i + 1) / buckets,
+            "count": len(bucket),
+            "mean": mean,
+            "p95": percentile(bucket, 95),
+            "throughput": 1 / mean if mean else 0.0,
+        })
+    return curve
+
+
+def linear_fit(
+    xs: Sequence[float], ys: Sequence[float]
+) -> Dict[str, float]:
+    """
+    Fits a line to the given points using least squares and returns the
+    slope, the intercept and the coefficient of determination (r2).
+    """
+    n = len(xs)
+    if n < 2 or n != len(ys):
+        raise ValueError("linear fit needs at least two points")
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    sxy = sum((x - mean_x) * (y - mean_y) for (x, y) in zip(xs, ys))
+    syy = sum((y - mean_y) ** 2 for y in ys)
+    slope = sxy / sxx if sxx else 0.0
+    r2 = sxy ** 2 / (sxx * syy) if sxx and syy else 0.0
+    return {
+        "slope": slope,
+        "intercept": mean_y - slope * mean_x,
+        "r2": r2,
+    }
+
+
+class Report:
+    """
+    Collects the results of the benchmarks executed in a test session so
+    that they can be written to a JSON file and compared between builds.
+    """
+    def __init__(self, metadata: Dict[str, Any]) -> None:
+        self.metadata = metadata
+        self.results: List[Dict[str, Any]] = []
+
+    def add(self, name: str, params: Dict[str, Any], **results: Any) -> None:
+        self.results.append(
+            {"name": name, "params": params, "results": results}
+        )
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(
+                {"metadata": self.metadata, "results": self.results},
+                f,
+                indent=2,
+                default=str,
+            )
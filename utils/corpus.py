@@ -0,0 +1,307 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import os.path
+import struct
+from dataclasses import dataclass, field
+from types import TracebackType
+from typing import (
+    Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional,
+    Sequence, Set, Tuple, Type
+)
+
+from pynitrokey.trussed.device import App
+
+from . import tracing
+
+
+logger = logging.getLogger(__name__)
+
+
+PACK_NAME = "corpus.pack"
+INDEX_NAME = "corpus.idx"
+STATS_NAME = "stats.json"
+# offset and length of the input in the pack file, number of records and
+# the first bytes of the SHA-256 hash of the input
+INDEX_ENTRY = struct.Struct("<QII16s")
+# records are prefixed with a single length byte, or with this byte and a
+# two-byte big-endian length if they are longer than 254 bytes
+EXTENDED_LENGTH = 0xFF
+MAX_RECORD = 0xFFFF
+
+
+def pack_dir(path: str) -> str:
+    """
+    Returns the directory for the pack and index files of the corpus in the
+    given directory.  It is not a subdirectory because the fuzzer reads all
+    files in the corpus directory recursively.
+    """
+    return os.path.normpath(path) + ".pack"
+
+
+def encode_records(records: Sequence[bytes]) -> bytes:
+    """
+    Encodes the records of a fuzzing input.  Each record is prefixed with its
+    length, see EXTENDED_LENGTH.  Records longer than MAX_RECORD bytes are
+    skipped.
+    """
+    parts = []
+    for record in records:
+        if len(record) > MAX_RECORD:
+            continue
+        if len(record) < EXTENDED_LENGTH:
+            parts.append(bytes([len(record)]))
+        else:
+            parts.append(bytes([EXTENDED_LENGTH]))
+            parts.append(len(record).to_bytes(2, "big"))
+        parts.append(record)
+    return b"".join(parts)
+
+
+def decode_records(data: bytes) -> List[bytes]:
+    records = []
+    i = 0
+    while i < len(data):
+        n = data[i]
+        i += 1
+        if n == EXTENDED_LENGTH:
+            if i + 2 > len(data):
+                raise ValueError("truncated corpus record length")
+            n = int.from_bytes(data[i:i + 2], "big")
+            i += 2
+        if i + n > len(data):
+            raise ValueError("truncated corpus record")
+        records.append(data[i:i + n])
+        i += n
+    return records
+
+
+class CorpusWriter:
+    """
+    Writes fuzzing inputs to a corpus directory.  Every input is written as a
+    separate file and appended to a pack file with a fixed-width index in
+    `pack_dir(path)`, see `Corpus`.  Inputs that are already stored in the
+    corpus and records longer than MAX_RECORD bytes are skipped and counted.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        os.makedirs(pack_dir(path), exist_ok=True)
+        self.digests: Set[bytes] = set()
+        for entry in Corpus(path).entries():
+            self.digests.add(entry[3])
+        self.pack: BinaryIO = open(
+            os.path.join(pack_dir(path), PACK_NAME), "ab"
+        )
+        self.index: BinaryIO = open(
+            os.path.join(pack_dir(path), INDEX_NAME), "ab"
+        )
+        self.duplicates = 0
+        self.dropped_records = 0
+
+    def __enter__(self) -> "CorpusWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.pack.close()
+        self.index.close()
+
+    def add(self, name: str, records: Sequence[bytes]) -> bool:
+        """
+        Adds the given input to the corpus and returns True if it was not
+        already present.
+        """
+        dropped = [r for r in records if len(r) > MAX_RECORD]
+        if dropped:
+            self.dropped_records += len(dropped)
+            logger.warning(
+                f"{name}: dropped {len(dropped)} corpus records longer than "
+                f"{MAX_RECORD} bytes"
+            )
+            records = [r for r in records if len(r) <= MAX_RECORD]
+        if not records:
+            return False
+        data = encode_records(records)
+        digest = hashlib.sha256(data).digest()[:16]
+        if digest in self.digests:
+            self.duplicates += 1
+            return False
+        self.digests.add(digest)
+
+        file_name = f"{name}-{digest.hex()}"
+        with open(os.path.join(self.path, file_name), "wb") as f:
+            f.write(data)
+        offset = self.pack.seek(0, os.SEEK_END)
+        self.pack.write(data)
+        self.pack.flush()
+        self.index.write(
+            INDEX_ENTRY.pack(offset, len(data), len(records), digest)
+        )
+        self.index.flush()
+        return True
+
+
+class CorpusInput:
+    """
+    Buffers the commands sent during a test so that they can be added to the
+    corpus as a single input.  Can be used as `SecretsApp.write_corpus_fn`.
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.records: List[bytes] = []
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "CorpusInput":
+        # copies of the Secrets App client have to write to the same input
+        return self
+
+    def __call__(self, ins: Any, data: bytes) -> None:
+        self.records.append(data)
+
+
+class Corpus:
+    """
+    Read access to the pack file of a corpus directory.  The files are memory
+    mapped so that single inputs can be read without parsing the full pack.
+    """
+    def __init__(self, path: str) -> None:
+        self.pack_path = os.path.join(pack_dir(path), PACK_NAME)
+        self.index_path = os.path.join(pack_dir(path), INDEX_NAME)
+
+    def _map(self, path: str) -> Optional[mmap.mmap]:
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def entries(self) -> Iterator[Tuple[int, int, int, bytes]]:
+        index = self._map(self.index_path)
+        if index is None:
+            return
+        with index:
+            n = len(index) // INDEX_ENTRY.size
+            for i in range(n):
+                (offset, length, records, digest) = INDEX_ENTRY.unpack_from(
+                    index, i * INDEX_ENTRY.size
+                )
+                yield (offset, length, records, digest)
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.index_path):
+            return 0
+        return os.path.getsize(self.index_path) // INDEX_ENTRY.size
+
+    def __iter__(self) -> Iterator[List[bytes]]:
+        pack = self._map(self.pack_path)
+        if pack is None:
+            return
+        with pack:
+            for (offset, length, _, _) in self.entries():
+                yield decode_records(pack[offset:offset + length])
+
+
+def response_shape(data: bytes) -> Tuple[int, ...]:
+    """
+    Returns the tags of the top-level TLV entries of a response, or the bit
+    length of the response size if it is not TLV-encoded.
+    """
+    tags = []
+    i = 0
+    while i < len(data):
+        if i + 2 > len(data) or i + 2 + data[i + 1] > len(data):
+            return (-1, len(data).bit_length())
+        tags.append(data[i])
+        i += 2 + data[i + 1]
+    return tuple(tags)
+
+
+# instruction, status word and response shape of a record
+Response = Tuple[int, bytes, Tuple[int, ...]]
+# responses for all records of an input
+Signature = Tuple[Response, ...]
+
+
+def execute(dev: Any, records: Sequence[bytes]) -> Signature:
+    """
+    Sends the records of an input to the Secrets App and returns the
+    signature of the responses.
+    """
+    signature: List[Response] = []
+    for record in records:
+        ins = record[1] if len(record) > 1 else -1
+        try:
+            response = dev._call_app(App.SECRETS, data=record)
+        except Exception as e:
+            tracing.event(logger, "command failed", request=record, error=e)
+            signature.append((ins, b"", (-2,)))
+            continue
+        signature.append((ins, response[:2], response_shape(response[2:])))
+    return tuple(signature)
+
+
+@dataclass
+class Minimization:
+    inputs: int = 0
+    size: int = 0
+    # smallest input per signature
+    clusters: Dict[Signature, List[bytes]] = field(default_factory=dict)
+    # number of inputs per signature
+    counts: Dict[Signature, int] = field(default_factory=dict)
+
+    def add(self, signature: Signature, records: List[bytes]) -> None:
+        self.inputs += 1
+        self.size += len(encode_records(records))
+        self.counts[signature] = self.counts.get(signature, 0) + 1
+        kept = self.clusters.get(signature)
+        if kept is None or _input_key(records) < _input_key(kept):
+            self.clusters[signature] = records
+
+    def stats(self) -> Dict[str, Any]:
+        minimized_size = sum(
+            len(encode_records(records)) for records in self.clusters.values()
+        )
+        counts = sorted(self.counts.values(), reverse=True)
+        return {
+            "inputs": self.inputs,
+            "size": self.size,
+            "clusters": len(self.clusters),
+            "minimized_size": minimized_size,
+            "largest_clusters": counts[:10],
+        }
+
+    def write(self, path: str) -> None:
+        with CorpusWriter(path) as writer:
+            for records in self.clusters.values():
+                writer.add("min", records)
+        with open(os.path.join(pack_dir(path), STATS_NAME), "w") as f:
+            json.dump(self.stats(), f, indent=2)
+
+
+def _input_key(records: List[bytes]) -> Tuple[int, int]:
+    return (len(encode_records(records)), len(records))
+
+
+def minimize(
+    dev: Any, inputs: Iterable[List[bytes]], reset: Callable[[], None]
+) -> Minimization:
+    """
+    Executes all inputs, calling `reset` before each input, and keeps the
+    smallest input for every signature of the responses.
+    """
+    result = Minimization()
+    for records in inputs:
+        reset()
+        result.add(execute(dev, records), records)
+    return result
@@ -6,6 +6,8 @@ import logging
 import os
 import os.path
 import random
+import re
+import shutil
 import time
 from abc import ABC, abstractmethod
 from contextlib import contextmanager
@@ -14,20 +16,29 @@ from enum import Enum
 from fido2.hid import open_device
 from pexpect import spawn
 from signal import SIGUSR1
-from subprocess import Popen
+from subprocess import PIPE, STDOUT, Popen
 from tempfile import TemporaryDirectory, mkdtemp
-from typing import Any, Generator, List, Optional, Sequence
+from typing import (
+    Any, Callable, Generator, List, Optional, Sequence, Tuple
+)
+from . import tracing
+from .pcsc import wait_for_reader
 from .subprocess import check_call, check_output
+from .supervisor import RunnerCrashed, Supervisor
 
 
 logger = logging.getLogger(__name__)
 
 
+BIN_DIR = "./bin"
+
 VID_NITROKEY = 0x20a0
 PID_NK3 = 0x42b2
 PID_NKPK = 0x42f3
 PIDS = [PID_NK3, PID_NKPK]
 
+POLL_INTERVAL = 0.1
+
 
 class Model(Enum):
     NK3 = enum.auto()
@@ -114,6 +125,10 @@ class UsbipState:
     serial: str
     user_presence: bool
     pin: Optional[str] = None
+    # wait until the CCID reader is available in pcscd after spawning
+    wait_for_reader: bool = False
+    # directory for the compressed runner logs
+    log_dir: Optional[str] = None
 
 
 class UsbipDevice(Device):
@@ -123,11 +138,20 @@ class UsbipDevice(Device):
         data: DeviceData,
         state: UsbipState,
         runner: Popen[bytes],
+        spawn_time: float,
+        reader_time: Optional[float] = None,
     ):
         super().__init__(data)
         self._binary = binary
         self._state = state
         self._runner = runner
+        # time from starting the runner until the hidraw device shows up
+        self.spawn_time = spawn_time
+        # time from the hidraw device showing up until the CCID reader is
+        # available in pcscd, if state.wait_for_reader is set
+        self.reader_time = reader_time
+        self.supervisor = Supervisor(os.path.basename(binary), state.log_dir)
+        self.supervisor.watch(runner)
 
     @property
     def serial(self) -> str:
@@ -150,31 +174,89 @@ class UsbipDevice(Device):
 
     def reboot(self) -> None:
         if self._runner:
+            self.supervisor.expect_exit(self._runner)
             self._runner.terminate()
 
-        (self._runner, self.data) = _spawn(self._binary, self._state)
+        self._start()
+
+    @property
+    def alive(self) -> bool:
+        return self._runner.poll() is None
+
+    def kill(self) -> None:
+        self.supervisor.expect_exit(self._runner)
+        self._runner.kill()
+
+    def check(self) -> Optional[RunnerCrashed]:
+        """
+        Returns the crash of the runner if it stopped or does not respond to
+        a CTAPHID ping.  A runner that does not respond is killed.
+        """
+        if self.supervisor.crashed:
+            return self.supervisor.crashed
+        lines = list(self.supervisor.lines)
+        if not self.alive:
+            return RunnerCrashed(f"exited with {self._runner.poll()}", lines)
+        if not self.supervisor.probe(self.hidraw):
+            crash = RunnerCrashed("does not respond to CTAPHID ping", lines)
+            self.supervisor.crashed = crash
+            self.kill()
+            return crash
+        return None
+
+    def snapshot(self, path: str) -> None:
+        """
+        Copies the state files to the given directory.  The runner is stopped
+        during the copy so that the files are consistent.
+        """
+        self._stop()
+        shutil.copyfile(self._state.ifs, os.path.join(path, "ifs.bin"))
+        shutil.copyfile(self._state.efs, os.path.join(path, "efs.bin"))
+        self._start()
+
+    def restore(self, path: str) -> None:
+        """
+        Restarts the runner with the state files from a snapshot.
+        """
+        self._stop()
+        shutil.copyfile(os.path.join(path, "ifs.bin"), self._state.ifs)
+        shutil.copyfile(os.path.join(path, "efs.bin"), self._state.efs)
+        self._start()
+
+    def _start(self) -> None:
+        (
+            self._runner, self.data, self.spawn_time, self.reader_time
+        ) = _spawn(self._binary, self._state)
+        self.supervisor.watch(self._runner)
+
+    def _stop(self) -> None:
+        self.supervisor.expect_exit(self._runner)
+        if self.alive:
+            self._runner.terminate()
+        self._runner.wait()
 
     def __enter__(self) -> "UsbipDevice":
         return self
 
     def __exit__(self, type: Any, value: Any, traceback: Any) -> None:
         if self._runner:
+            self.supervisor.expect_exit(self._runner)
             self._runner.terminate()
 
     def provision(self) -> None:
-        logger.debug("Provisioning usbip-runner")
-        check_call(
-            [
-                "nitropy",
-                "nk3",
-                "provision",
-                "fido2",
-                "--cert",
-                "data/fido.cert",
-                "--key",
-                "data/fido.key",
-            ],
-        )
+        with tracing.span(logger, "provision", serial=self.serial):
+            check_call(
+                [
+                    "nitropy",
+                    "nk3",
+                    "provision",
+                    "fido2",
+                    "--cert",
+                    "data/fido.cert",
+                    "--key",
+                    "data/fido.key",
+                ],
+            )
 
     @staticmethod
     def spawn(binary: str, state: UsbipState) -> "UsbipDevice":
@@ -186,12 +268,17 @@ class UsbipDevice(Device):
                 "`modprobe vhci-hcd`"
             )
 
-        (runner, device) = _spawn(binary, state)
+        (runner, device, spawn_time, reader_time) = _spawn(binary, state)
 
-        return UsbipDevice(binary, device, state, runner)
+        return UsbipDevice(
+            binary, device, state, runner, spawn_time, reader_time
+        )
 
 
-def _spawn(binary: str, state: UsbipState) -> tuple[Popen[bytes], DeviceData]:
+def _spawn(
+    binary: str, state: UsbipState
+) -> tuple[Popen[bytes], DeviceData, float, Optional[float]]:
+    start = time.monotonic()
     env = os.environ.copy()
     if "RUST_LOG" not in env:
         env["RUST_LOG"] = "info"
@@ -205,10 +292,17 @@ def _spawn(binary: str, state: UsbipState) -> tuple[Popen[bytes], DeviceData]:
             "--user-presence", user_presence,
         ],
         env=env,
+        stdout=PIPE,
+        stderr=STDOUT,
     )
-    logger.debug(
-        f"{binary} spawned: pid={runner.pid}, ifs={state.ifs}, "
-        f", efs={state.efs}, serial={state.serial})"
+    tracing.event(
+        logger,
+        "runner spawned",
+        binary=binary,
+        pid=runner.pid,
+        ifs=state.ifs,
+        efs=state.efs,
+        serial=state.serial,
     )
 
     host = "localhost"
@@ -216,22 +310,35 @@ def _spawn(binary: str, state: UsbipState) -> tuple[Popen[bytes], DeviceData]:
     check_call(["usbip", "attach", "-r", host, "-b", "1-1"])
     check_call(["usbip", "attach", "-r", host, "-b", "1-1"])
 
-    for i in range(5):
-        if not find_devices(VID_NITROKEY, PIDS):
-            time.sleep(1)
-        else:
-            break
+    _poll(lambda: bool(find_devices(VID_NITROKEY, PIDS)))
     device = find_device(VID_NITROKEY, PIDS)
 
-    for i in range(5):
-        if not os.path.exists(f"/dev/{device.hidraw}"):
-            time.sleep(1)
-        else:
-            break
-    if not os.path.exists(f"/dev/{device.hidraw}"):
+    if not _poll(lambda: os.path.exists(f"/dev/{device.hidraw}")):
         raise RuntimeError(f"hidraw device {device.hidraw} does not show up")
+    spawn_time = time.monotonic() - start
+    tracing.event(
+        logger, "device available", device=device.hidraw, time=spawn_time
+    )
+
+    reader_time = None
+    if state.wait_for_reader:
+        model = Model.from_vid_pid(device.vid, device.pid)
+        reader = wait_for_reader(model.name)
+        reader_time = time.monotonic() - start - spawn_time
+        tracing.event(
+            logger, "reader available", reader=reader, time=reader_time
+        )
+
+    return (runner, device, spawn_time, reader_time)
+
 
-    return (runner, device)
+def _poll(condition: Callable[[], bool], timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(POLL_INTERVAL)
+    return True
 
 
 device_pin: Optional[str] = None
@@ -298,9 +405,12 @@ def find_devices(vid: int, pids: Sequence[int]) -> List[DeviceData]:
         if current_vid == vid and current_pid in pids:
             device = find_hidraw_device(root, subdirs)
             if device:
-                logger.debug(
-                    f"found USB device: vid={current_vid:04x}, "
-                    f"pid={current_pid:04x}, device={device}"
+                tracing.event(
+                    logger,
+                    "found USB device",
+                    vid=f"{current_vid:04x}",
+                    pid=f"{current_pid:04x}",
+                    device=device,
                 )
                 data = DeviceData(
                     hidraw=device,
@@ -326,6 +436,23 @@ def get_serial(device: str) -> str:
     return serial.hex().upper()
 
 
+def get_free_blocks(device: Device) -> Optional[Tuple[int, int]]:
+    """
+    Returns the number of free blocks in the internal and the external
+    filesystem as reported by `nitropy nk3 status`, or None if the firmware
+    does not report them, like older releases.
+    """
+    status = check_output(["nitropy", device.model.command, "status"])
+    blocks = []
+    for fs in ["int", "ext"]:
+        match = re.search(rf"Free blocks \({fs}\):\s*(\d+)", status)
+        if not match:
+            logger.info(f"free blocks ({fs}) missing in status output")
+            return None
+        blocks.append(int(match.group(1)))
+    return (blocks[0], blocks[1])
+
+
 def generate_serial() -> str:
     return random.randbytes(16).hex().upper()
 
@@ -344,6 +471,12 @@ def set_pin(old_pin: Optional[str], new_pin: str) -> None:
     p.expect("done")
 
 
+def get_binary(name: str, suffix: Optional[str] = None) -> str:
+    if suffix:
+        name += "-" + suffix
+    return os.path.join(BIN_DIR, name)
+
+
 @contextmanager
 def spawn_device(
     ifs: str,
@@ -352,16 +485,14 @@ def spawn_device(
     user_presence: bool = False,
     provision: bool = True,
     suffix: Optional[str] = None,
-) -> Generator[Device, None, None]:
-    runner = "usbip-runner"
-    provisioner = "usbip-provisioner"
-    if suffix:
-        runner += "-" + suffix
-        provisioner += "-" + suffix
-
-    bin_dir = "./bin"
-    runner_binary = os.path.join(bin_dir, runner)
-    provisioner_binary = os.path.join(bin_dir, provisioner)
+    binary: Optional[str] = None,
+    wait_for_reader: bool = False,
+    log_dir: Optional[str] = None,
+) -> Generator[UsbipDevice, None, None]:
+    runner_binary = binary or get_binary("usbip-runner", suffix)
+    provisioner_binary = get_binary("usbip-provisioner", suffix)
+    runner = os.path.basename(runner_binary)
+    provisioner = os.path.basename(provisioner_binary)
     if not os.path.exists(runner_binary):
         raise RuntimeError(f"{runner} binary is missing")
     if provision and not os.path.exists(provisioner_binary):
@@ -371,11 +502,16 @@ def spawn_device(
         serial = generate_serial()
 
     state = UsbipState(
-        ifs=ifs, efs=efs, serial=serial, user_presence=user_presence
+        ifs=ifs,
+        efs=efs,
+        serial=serial,
+        user_presence=user_presence,
+        log_dir=log_dir,
     )
     if provision:
         with UsbipDevice.spawn(provisioner_binary, state) as device:
             device.provision()
+    state.wait_for_reader = wait_for_reader
     with UsbipDevice.spawn(runner_binary, state) as device:
         yield device
 
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: CC0-1.0
 
 import fido2.features
+import logging
 from fido2.client import Fido2Client, PinRequiredError, UserInteraction
 from fido2.hid import open_device
 from fido2.server import Fido2Server
@@ -16,9 +17,12 @@ from fido2.webauthn import (
 )
 from typing import Any, List, Optional
 
+from . import tracing
 from .device import Device
 
 
+logger = logging.getLogger(__name__)
+
 fido2.features.webauthn_json_mapping.enabled = False
 
 
@@ -50,6 +54,7 @@ class Fido2:
         device: Device,
         pin: Optional[str] = None,
     ) -> None:
+        self.hidraw = device.hidraw
         hid_device = open_device(f"/dev/{device.hidraw}")
         self.client = Fido2Client(
             hid_device,
@@ -81,9 +86,15 @@ class Fido2:
             resident_key_requirement=resident_key_requirement,
         )
 
-        make_credential_result = self.client.make_credential(
-            create_options.public_key,
-        )
+        with tracing.span(
+            logger,
+            "make_credential",
+            device=self.hidraw,
+            resident_key=resident_key,
+        ):
+            make_credential_result = self.client.make_credential(
+                create_options.public_key,
+            )
         if require_attestation:
             assert "x5c" in make_credential_result.attestation_object.att_stmt
 
@@ -102,9 +113,15 @@ class Fido2:
             user_verification=UserVerificationRequirement.DISCOURAGED,
         )
 
-        get_assertion_result = self.client.get_assertion(
-            request_options.public_key,
-        )
+        with tracing.span(
+            logger,
+            "get_assertion",
+            device=self.hidraw,
+            credentials=len(credentials),
+        ):
+            get_assertion_result = self.client.get_assertion(
+                request_options.public_key,
+            )
         get_assertion_response = get_assertion_result.get_response(0)
         assert get_assertion_response.credential_id
 
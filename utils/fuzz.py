@@ -0,0 +1,195 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+import hashlib
+import logging
+import os
+import os.path
+import random
+import threading
+import time
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, List, Optional, Sequence
+
+from pynitrokey.nk3.device import Nitrokey3Device
+from pynitrokey.trussed.device import App
+
+from . import tracing
+from .corpus import MAX_RECORD, encode_records
+from .device import UsbipDevice
+
+
+logger = logging.getLogger(__name__)
+
+# maximum duration of a single command before the runner is considered hung
+HANG_TIMEOUT = 5.0
+MAX_RECORDS = 32
+
+
+def _flip_bit(rng: random.Random, record: bytearray) -> None:
+    if record:
+        record[rng.randrange(len(record))] ^= 1 << rng.randrange(8)
+
+
+def _set_byte(rng: random.Random, record: bytearray) -> None:
+    if record:
+        value = rng.choice([0x00, 0x01, 0x7F, 0x80, 0xFF, rng.randrange(256)])
+        record[rng.randrange(len(record))] = value
+
+
+def _insert_bytes(rng: random.Random, record: bytearray) -> None:
+    i = rng.randrange(len(record) + 1)
+    record[i:i] = bytes(rng.randrange(256) for _ in range(rng.randint(1, 8)))
+
+
+def _delete_bytes(rng: random.Random, record: bytearray) -> None:
+    if record:
+        i = rng.randrange(len(record))
+        del record[i:i + rng.randint(1, 8)]
+
+
+def _fix_length(rng: random.Random, record: bytearray) -> None:
+    # keep the Lc byte of short APDUs consistent with the data
+    if 5 <= len(record) <= 260:
+        record[4] = len(record) - 5
+
+
+BYTE_MUTATIONS: List[Callable[[random.Random, bytearray], None]] = [
+    _flip_bit, _set_byte, _insert_bytes, _delete_bytes, _fix_length,
+]
+
+
+def mutate(
+    rng: random.Random,
+    records: Sequence[bytes],
+    corpus: Sequence[Sequence[bytes]],
+) -> List[bytes]:
+    """
+    Returns a mutated copy of the given input.  Either a single record is
+    mutated, or records are duplicated, removed or spliced from another
+    input of the corpus.
+    """
+    result = list(records)
+    choice = rng.randrange(10)
+    if choice == 0 and len(result) > 1:
+        del result[rng.randrange(len(result))]
+    elif choice == 1 and len(result) < MAX_RECORDS:
+        result.insert(rng.randrange(len(result) + 1), rng.choice(result))
+    elif choice == 2:
+        other = rng.choice(corpus)
+        if other:
+            i = rng.randrange(len(result) + 1)
+            result[i:i] = other[:MAX_RECORDS - len(result)]
+    if not result:
+        return result
+    i = rng.randrange(len(result))
+    record = bytearray(result[i])
+    for _ in range(rng.randint(1, 4)):
+        rng.choice(BYTE_MUTATIONS)(rng, record)
+    # longer records cannot be stored in the corpus format
+    result[i] = bytes(record[:MAX_RECORD])
+    return result
+
+
+@dataclass
+class FuzzStats:
+    executions: int = 0
+    crashes: int = 0
+    hangs: int = 0
+    restores: int = 0
+    duration: float = 0.0
+
+    @property
+    def executions_per_second(self) -> float:
+        if not self.duration:
+            return 0.0
+        return self.executions / self.duration
+
+
+class Fuzzer:
+    """
+    Sends mutated corpus inputs to the Secrets App of a virtual device.  If
+    the runner crashes or does not respond within `HANG_TIMEOUT`, the input
+    is stored in `crash_path` and the runner is restarted with the state
+    from the start of the fuzzing run.
+    """
+    def __init__(
+        self,
+        device: UsbipDevice,
+        corpus: Sequence[Sequence[bytes]],
+        crash_path: str,
+        seed: Optional[int] = None,
+    ) -> None:
+        if not corpus:
+            raise ValueError("empty corpus")
+        self.device = device
+        self.corpus = corpus
+        self.crash_path = crash_path
+        self.rng = random.Random(seed)
+        self.stats = FuzzStats()
+        self.crashing_inputs: List[str] = []
+
+    def run(self, duration: float) -> FuzzStats:
+        os.makedirs(self.crash_path, exist_ok=True)
+        with self.device.supervisor.expect_crashes(), \
+                TemporaryDirectory() as snapshot:
+            self.device.snapshot(snapshot)
+            start = time.monotonic()
+            deadline = start + duration
+            nk3 = self._open()
+            try:
+                while time.monotonic() < deadline:
+                    records = mutate(
+                        self.rng, self.rng.choice(self.corpus), self.corpus
+                    )
+                    failure = self._execute(nk3, records)
+                    self.stats.executions += 1
+                    if failure:
+                        self._store(failure, records)
+                        nk3.close()
+                        self.device.restore(snapshot)
+                        self.stats.restores += 1
+                        nk3 = self._open()
+            finally:
+                nk3.close()
+            self.stats.duration = time.monotonic() - start
+        return self.stats
+
+    def _open(self) -> Nitrokey3Device:
+        nk3 = Nitrokey3Device.open(f"/dev/{self.device.hidraw}")
+        if not nk3:
+            raise RuntimeError(f"could not open {self.device.hidraw}")
+        return nk3
+
+    def _execute(self, nk3: Any, records: Sequence[bytes]) -> Optional[str]:
+        for record in records:
+            watchdog = threading.Timer(HANG_TIMEOUT, self.device.kill)
+            watchdog.start()
+            try:
+                nk3._call_app(App.SECRETS, data=record)
+            except Exception as e:
+                if not self.device.alive:
+                    hang = not watchdog.is_alive()
+                    tracing.event(
+                        logger, "runner stopped", error=e, hang=hang
+                    )
+                    return "hang" if hang else "crash"
+            finally:
+                watchdog.cancel()
+            if not self.device.alive:
+                return "crash"
+        return None
+
+    def _store(self, failure: str, records: Sequence[bytes]) -> None:
+        if failure == "hang":
+            self.stats.hangs += 1
+        else:
+            self.stats.crashes += 1
+        data = encode_records(records)
+        name = f"{failure}-{hashlib.sha256(data).hexdigest()[:16]}"
+        path = os.path.join(self.crash_path, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        self.crashing_inputs.append(path)
+        logger.info(f"Stored {failure} input in {path}")
@@ -0,0 +1,486 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+import hashlib
+import os
+import os.path
+import subprocess
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+    Ed25519PublicKey
+)
+from cryptography.hazmat.primitives.asymmetric.utils import (
+    Prehashed, encode_dss_signature
+)
+from cryptography.hazmat.primitives.asymmetric.x25519 import (
+    X25519PrivateKey, X25519PublicKey
+)
+
+from .benchmark import Samples
+
+
+# key algorithms supported by `oct admin generate`
+OPCARD_ALGORITHMS = [
+    "nistp256", "nistp384", "cv25519", "rsa2048", "rsa3072", "rsa4096",
+]
+OPCARD_OPERATIONS = ["generate", "sign", "decrypt"]
+# clients used to access the card: the oct command line tool, or
+# `OpenPgpSession` with a single PC/SC connection
+OPCARD_CLIENTS = ["oct", "pcsc"]
+OPCARD_USER_PIN = "123456"
+OPCARD_ADMIN_PIN = "12345678"
+# RSA key generation on the device can take several minutes
+GENERATE_TIMEOUT = 600
+TIMEOUT = 60
+
+
+def card_id(serial: str) -> str:
+    """
+    Returns the OpenPGP card identifier used by `oct` for the device with the
+    given serial number.
+    """
+    return f"000F:{serial[:8]}"
+
+
+def _run(args: List[str], timeout: int = TIMEOUT) -> str:
+    return subprocess.check_output(
+        args, stderr=subprocess.STDOUT, encoding="utf-8", timeout=timeout
+    )
+
+
+class OpenPgpCard:
+    """
+    Runs the OpenPGP card operations with `oct`, `sq` and `sqv`.  The PIN
+    files, keys and signatures are stored in the directory `d`.
+    """
+    def __init__(self, serial: str, d: str) -> None:
+        self.card_id = card_id(serial)
+        self.d = d
+        self.user_pin_path = os.path.join(d, "user-pin")
+        self.admin_pin_path = os.path.join(d, "admin-pin")
+        self.public_key_path = os.path.join(d, "public-key.asc")
+        with open(self.user_pin_path, "w") as f:
+            f.write(OPCARD_USER_PIN)
+        with open(self.admin_pin_path, "w") as f:
+            f.write(OPCARD_ADMIN_PIN)
+
+    def factory_reset(self) -> None:
+        output = _run(
+            ["oct", "system", "factory-reset", "--card", self.card_id]
+        )
+        assert f"Resetting Card {self.card_id}" in output
+
+    def generate(self, algorithm: str) -> None:
+        output = _run(
+            [
+                "oct", "admin", "-P", self.admin_pin_path,
+                "--card", self.card_id,
+                "generate", "-p", self.user_pin_path,
+                "-o", self.public_key_path, algorithm,
+            ],
+            timeout=GENERATE_TIMEOUT,
+        )
+        for key in ["Signing", "Decryption", "Authentication"]:
+            assert f" Generate subkey for {key}" in output
+
+    def sign(self, data_path: str, sig_path: str) -> None:
+        _run([
+            "oct", "sign", "--card", self.card_id, "-p", self.user_pin_path,
+            "detached", "-o", sig_path, data_path,
+        ])
+
+    def verify(self, data_path: str, sig_path: str) -> None:
+        output = _run([
+            "sqv", sig_path, data_path,
+            "--keyring", self.public_key_path, "-v",
+        ])
+        assert "1 of 1 signatures are valid (threshold is: 1)." in output
+
+    def encrypt(self, data_path: str, message_path: str) -> None:
+        _run([
+            "sq", "encrypt", "--recipient-file", self.public_key_path,
+            "--output", message_path, data_path,
+        ])
+
+    def decrypt(self, message_path: str) -> bytes:
+        return subprocess.check_output(
+            [
+                "oct", "decrypt", "--card", self.card_id,
+                "-p", self.user_pin_path, message_path,
+            ],
+            timeout=TIMEOUT,
+        )
+
+
+OPENPGP_AID = bytes.fromhex("D27600012401")
+# PIN references for VERIFY
+PW1_SIGN = 0x81
+PW1_OTHER = 0x82
+PW3 = 0x83
+# control reference template and algorithm attributes data object per key
+KEY_SLOTS = {"sig": (0xB6, 0xC1), "dec": (0xB8, 0xC2), "aut": (0xA4, 0xC3)}
+STATUS_OK = 0x9000
+STATUS_MORE_DATA = 0x61
+STATUS_PIN_BLOCKED = 0x6983
+MAX_SHORT_DATA = 0xFF
+
+OID_NISTP256 = bytes.fromhex("2A8648CE3D030107")
+OID_NISTP384 = bytes.fromhex("2B81040022")
+OID_ED25519 = bytes.fromhex("2B06010401DA470F01")
+OID_CV25519 = bytes.fromhex("2B060104019755010501")
+CURVES: Dict[bytes, ec.EllipticCurve] = {
+    OID_NISTP256: ec.SECP256R1(),
+    OID_NISTP384: ec.SECP384R1(),
+}
+ECDH = 0x12
+ECDSA = 0x13
+EDDSA = 0x16
+
+
+def _rsa_attributes(bits: int) -> bytes:
+    # modulus length, public exponent length (32 bits), standard format
+    return b"\x01" + bits.to_bytes(2, "big") + b"\x00\x20\x00"
+
+
+# algorithm attributes of the signing and authentication keys and of the
+# decryption key
+ALGORITHM_ATTRIBUTES = {
+    "nistp256": (bytes([ECDSA]) + OID_NISTP256, bytes([ECDH]) + OID_NISTP256),
+    "nistp384": (bytes([ECDSA]) + OID_NISTP384, bytes([ECDH]) + OID_NISTP384),
+    "cv25519": (bytes([EDDSA]) + OID_ED25519, bytes([ECDH]) + OID_CV25519),
+    "rsa2048": (_rsa_attributes(2048), _rsa_attributes(2048)),
+    "rsa3072": (_rsa_attributes(3072), _rsa_attributes(3072)),
+    "rsa4096": (_rsa_attributes(4096), _rsa_attributes(4096)),
+}
+
+PublicKey = Union[
+    ec.EllipticCurvePublicKey,
+    rsa.RSAPublicKey,
+    Ed25519PublicKey,
+    X25519PublicKey,
+]
+
+
+class OpenPgpCardError(Exception):
+    def __init__(self, status: int) -> None:
+        super().__init__(f"OpenPGP card returned status 0x{status:04x}")
+        self.status = status
+
+
+def _decode_tlv(data: bytes) -> Dict[int, bytes]:
+    """
+    Decodes the top-level BER-TLV entries of the given data.
+    """
+    entries = {}
+    i = 0
+    while i < len(data):
+        tag = data[i]
+        i += 1
+        if tag & 0x1F == 0x1F:
+            tag = (tag << 8) | data[i]
+            i += 1
+        length = data[i]
+        i += 1
+        if length & 0x80:
+            n = length & 0x7F
+            length = int.from_bytes(data[i:i + n], "big")
+            i += n
+        entries[tag] = data[i:i + length]
+        i += length
+    return entries
+
+
+def _encode_tlv(tag: int, value: bytes) -> bytes:
+    tag_bytes = tag.to_bytes(2 if tag > 0xFF else 1, "big")
+    if len(value) < 0x80:
+        length = bytes([len(value)])
+    elif len(value) <= 0xFF:
+        length = bytes([0x81, len(value)])
+    else:
+        length = b"\x82" + len(value).to_bytes(2, "big")
+    return tag_bytes + length + value
+
+
+def _raw_point(point: bytes) -> bytes:
+    # Curve25519 points can be prefixed with 0x40
+    if len(point) == 33 and point[0] == 0x40:
+        return point[1:]
+    return point
+
+
+def _public_key(attributes: bytes, fields: Dict[int, bytes]) -> PublicKey:
+    if attributes[0] == 0x01:
+        n = int.from_bytes(fields[0x81], "big")
+        e = int.from_bytes(fields[0x82], "big")
+        return rsa.RSAPublicNumbers(e, n).public_key()
+    oid = attributes[1:]
+    point = fields[0x86]
+    if oid == OID_ED25519:
+        return Ed25519PublicKey.from_public_bytes(_raw_point(point))
+    if oid == OID_CV25519:
+        return X25519PublicKey.from_public_bytes(_raw_point(point))
+    return ec.EllipticCurvePublicKey.from_encoded_point(CURVES[oid], point)
+
+
+def _hash(algorithm: str) -> hashes.HashAlgorithm:
+    if algorithm == "nistp384":
+        return hashes.SHA384()
+    return hashes.SHA256()
+
+
+def signature_input(algorithm: str, data: bytes) -> bytes:
+    """
+    Returns the input for the PSO: COMPUTE DIGITAL SIGNATURE command for the
+    given data, i. e. the hash of the data, as a DigestInfo for RSA keys.
+    """
+    h = _hash(algorithm)
+    digest = hashlib.new(h.name, data).digest()
+    if algorithm.startswith("rsa"):
+        # DER prefix of a DigestInfo with SHA-256
+        prefix = bytes.fromhex("3031300d060960864801650304020105000420")
+        return prefix + digest
+    return digest
+
+
+def verify_signature(
+    algorithm: str, key: PublicKey, data: bytes, signature: bytes
+) -> None:
+    """
+    Verifies a signature created by the card for the given data, see
+    `signature_input`.  Raises an `InvalidSignature` if it is not valid.
+    """
+    h = _hash(algorithm)
+    digest = hashlib.new(h.name, data).digest()
+    if isinstance(key, rsa.RSAPublicKey):
+        key.verify(signature, digest, padding.PKCS1v15(), Prehashed(h))
+    elif isinstance(key, Ed25519PublicKey):
+        key.verify(signature, digest)
+    elif isinstance(key, ec.EllipticCurvePublicKey):
+        n = len(signature) // 2
+        der = encode_dss_signature(
+            int.from_bytes(signature[:n], "big"),
+            int.from_bytes(signature[n:], "big"),
+        )
+        key.verify(der, digest, ec.ECDSA(Prehashed(h)))
+    else:
+        raise ValueError(f"not a signing key: {key}")
+
+
+def decryption_input(key: PublicKey) -> Tuple[bytes, bytes]:
+    """
+    Returns the input for the PSO: DECIPHER command and the expected output,
+    a random session key for RSA keys, or the shared secret with an
+    ephemeral key for ECDH keys.
+    """
+    if isinstance(key, rsa.RSAPublicKey):
+        secret = os.urandom(32)
+        ciphertext = key.encrypt(secret, padding.PKCS1v15())
+        # padding indicator byte
+        return (b"\x00" + ciphertext, secret)
+    if isinstance(key, X25519PublicKey):
+        x25519 = X25519PrivateKey.generate()
+        point = x25519.public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+        expected = x25519.exchange(key)
+    elif isinstance(key, ec.EllipticCurvePublicKey):
+        private_key = ec.generate_private_key(key.curve)
+        point = private_key.public_key().public_bytes(
+            serialization.Encoding.X962,
+            serialization.PublicFormat.UncompressedPoint,
+        )
+        expected = private_key.exchange(ec.ECDH(), key)
+    else:
+        raise ValueError(f"not a decryption key: {key}")
+    data = _encode_tlv(0xA6, _encode_tlv(0x7F49, _encode_tlv(0x86, point)))
+    return (data, expected)
+
+
+class OpenPgpSession:
+    """
+    An OpenPGP card client that keeps a single PC/SC connection to the card
+    open for all operations.  Requires pyscard.
+    """
+    def __init__(self, connection: Any) -> None:
+        self.connection = connection
+        self.verified: Set[int] = set()
+        self.select()
+
+    @staticmethod
+    def open(serial: str) -> "OpenPgpSession":
+        """
+        Connects to the reader with the OpenPGP card of the device with the
+        given serial number, see `card_id`.
+        """
+        from smartcard.System import readers
+
+        ident = card_id(serial)
+        for reader in readers():
+            connection = reader.createConnection()
+            try:
+                connection.connect()
+            except Exception:
+                continue
+            try:
+                session = OpenPgpSession(connection)
+                if session.ident() == ident:
+                    return session
+            except OpenPgpCardError:
+                pass
+            connection.disconnect()
+        raise RuntimeError(f"OpenPGP card {ident} not found")
+
+    def close(self) -> None:
+        self.connection.disconnect()
+
+    def __enter__(self) -> "OpenPgpSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def transmit(
+        self, ins: int, p1: int, p2: int, data: bytes = b"", le: bool = True
+    ) -> bytes:
+        """
+        Sends a command to the card and returns the response data.  Long
+        commands are split using command chaining, and long responses are
+        fetched with GET RESPONSE.
+        """
+        chunks = [
+            data[i:i + MAX_SHORT_DATA]
+            for i in range(0, len(data), MAX_SHORT_DATA)
+        ] or [b""]
+        for (i, chunk) in enumerate(chunks):
+            last = i == len(chunks) - 1
+            apdu = [0x00 if last else 0x10, ins, p1, p2]
+            if chunk:
+                apdu += [len(chunk)] + list(chunk)
+            if last and le:
+                apdu.append(0x00)
+            (response, sw1, sw2) = self.connection.transmit(apdu)
+            if not last and (sw1, sw2) != (0x90, 0x00):
+                raise OpenPgpCardError((sw1 << 8) | sw2)
+        result = bytes(response)
+        while sw1 == STATUS_MORE_DATA:
+            (response, sw1, sw2) = self.connection.transmit(
+                [0x00, 0xC0, 0x00, 0x00, sw2]
+            )
+            result += bytes(response)
+        if (sw1 << 8) | sw2 != STATUS_OK:
+            raise OpenPgpCardError((sw1 << 8) | sw2)
+        return result
+
+    def select(self) -> None:
+        self.transmit(0xA4, 0x04, 0x00, OPENPGP_AID, le=False)
+        self.verified.clear()
+
+    def ident(self) -> str:
+        # D2 76 00 01 24 01, version, manufacturer, serial number, RFU
+        aid = self.transmit(0xCA, 0x00, 0x4F)
+        return f"{aid[8:10].hex().upper()}:{aid[10:14].hex().upper()}"
+
+    def verify(self, reference: int, pin: str) -> None:
+        if reference not in self.verified:
+            self.transmit(0x20, 0x00, reference, pin.encode(), le=False)
+            self.verified.add(reference)
+
+    def factory_reset(self) -> None:
+        """
+        Terminates and activates the OpenPGP application.  If the admin PIN
+        is not the default PIN, it is blocked first.
+        """
+        try:
+            self.verify(PW3, OPCARD_ADMIN_PIN)
+        except OpenPgpCardError:
+            for _ in range(3):
+                try:
+                    self.transmit(0x20, 0x00, PW3, b"00000000", le=False)
+                except OpenPgpCardError as e:
+                    if e.status == STATUS_PIN_BLOCKED:
+                        break
+        self.transmit(0xE6, 0x00, 0x00, le=False)
+        self.transmit(0x44, 0x00, 0x00, le=False)
+        self.select()
+
+    def generate(self, algorithm: str) -> Dict[str, PublicKey]:
+        """
+        Generates the signing, decryption and authentication keys with the
+        given algorithm and returns the public keys.
+        """
+        self.verify(PW3, OPCARD_ADMIN_PIN)
+        (sig_attributes, dec_attributes) = ALGORITHM_ATTRIBUTES[algorithm]
+        keys = {}
+        for (slot, (crt, do)) in KEY_SLOTS.items():
+            attributes = dec_attributes if slot == "dec" else sig_attributes
+            self.transmit(0xDA, 0x00, do, attributes, le=False)
+            response = self.transmit(0x47, 0x80, 0x00, bytes([crt, 0x00]))
+            public_key = _decode_tlv(_decode_tlv(response)[0x7F49])
+            keys[slot] = _public_key(attributes, public_key)
+        return keys
+
+    def sign(self, data: bytes) -> bytes:
+        """
+        Signs the given input, see `signature_input`.
+        """
+        self.verify(PW1_SIGN, OPCARD_USER_PIN)
+        # PW1 is only valid for a single signature by default
+        self.verified.discard(PW1_SIGN)
+        return self.transmit(0x2A, 0x9E, 0x9A, data)
+
+    def decrypt(self, data: bytes) -> bytes:
+        """
+        Decrypts the given input, see `decryption_input`.
+        """
+        self.verify(PW1_OTHER, OPCARD_USER_PIN)
+        return self.transmit(0x2A, 0x80, 0x86, data)
+
+
+class OpcardComparison:
+    """
+    Collects the durations of the OpenPGP card operations per client and key
+    algorithm so that they can be compared in a table.
+    """
+    def __init__(self, build: str) -> None:
+        self.build = build
+        # (client, algorithm) -> operation -> durations
+        self.operations: Dict[Tuple[str, str], Dict[str, Samples]] = \
+            defaultdict(lambda: defaultdict(Samples))
+
+    def add(
+        self,
+        algorithm: str,
+        operation: str,
+        samples: Samples,
+        client: str = "oct",
+    ) -> None:
+        for duration in samples.values:
+            self.operations[(client, algorithm)][operation].add(duration)
+
+    def table(self) -> List[str]:
+        lines = [
+            f"{'build':<16}{'client':<8}{'algorithm':<12}{'operation':<12}"
+            f"{'count':>8}{'p50 [ms]':>12}{'p95 [ms]':>12}{'max [ms]':>12}"
+        ]
+        for algorithm in OPCARD_ALGORITHMS:
+            for client in OPCARD_CLIENTS:
+                operations: Optional[Dict[str, Samples]] = \
+                    self.operations.get((client, algorithm))
+                if operations is None:
+                    continue
+                for operation in OPCARD_OPERATIONS:
+                    summary = operations[operation].summary()
+                    if not summary["count"]:
+                        continue
+                    lines.append(
+                        f"{self.build:<16}{client:<8}{algorithm:<12}"
+                        f"{operation:<12}{summary['count']:>8}"
+                        f"{summary['p50'] * 1000:>12.1f}"
+                        f"{summary['p95'] * 1000:>12.1f}"
+                        f"{summary['max'] * 1000:>12.1f}"
+                    )
+        return lines
@@ -0,0 +1,115 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+import hashlib
+import hmac
+import os
+import os.path
+from tempfile import NamedTemporaryFile
+from typing import Dict, List, Optional, Tuple
+
+
+OTP_CACHE_PATH = "./cache/otp"
+# number of consecutive counter values that are calculated and cached at once
+BLOCK_SIZE = 256
+
+
+def hotp_codes(
+    secret: bytes,
+    start: int,
+    count: int,
+    digits: int = 6,
+    algorithm: str = "sha1",
+) -> List[bytes]:
+    """
+    Calculates the RFC 4226 HOTP codes for `count` consecutive counter values
+    starting at `start`.  The HMAC key is only set up once for all values.
+    """
+    mac = hmac.new(secret, digestmod=algorithm)
+    modulus = 10 ** digits
+    codes = []
+    for counter in range(start, start + count):
+        h = mac.copy()
+        h.update(counter.to_bytes(8, "big"))
+        digest = h.digest()
+        offset = digest[-1] & 0x0F
+        value = int.from_bytes(digest[offset:offset + 4], "big") & 0x7FFFFFFF
+        codes.append(str(value % modulus).zfill(digits).encode())
+    return codes
+
+
+Key = Tuple[bytes, str, int, int]
+
+
+class ReferenceVectors:
+    """
+    Reference HOTP and TOTP codes for the Secrets App tests.  The codes are
+    calculated in blocks of consecutive counter values and memoized in memory
+    and, if a path is set, on disk across test sessions.
+    """
+    def __init__(self, path: Optional[str] = OTP_CACHE_PATH) -> None:
+        self.path = path
+        self._blocks: Dict[Key, List[bytes]] = {}
+
+    def hotp(
+        self,
+        secret: bytes,
+        counter: int,
+        digits: int = 6,
+        algorithm: str = "sha1",
+    ) -> bytes:
+        block = self._block((secret, algorithm, digits, counter // BLOCK_SIZE))
+        return block[counter % BLOCK_SIZE]
+
+    def totp(
+        self,
+        secret: bytes,
+        t: int,
+        digits: int = 6,
+        algorithm: str = "sha1",
+        period: int = 30,
+    ) -> bytes:
+        return self.hotp(secret, t // period, digits, algorithm)
+
+    def _block(self, key: Key) -> List[bytes]:
+        block = self._blocks.get(key)
+        if block is None:
+            block = self._load(key)
+            if block is None:
+                (secret, algorithm, digits, index) = key
+                block = hotp_codes(
+                    secret, index * BLOCK_SIZE, BLOCK_SIZE, digits, algorithm
+                )
+                self._store(key, block)
+            self._blocks[key] = block
+        return block
+
+    def _file(self, key: Key) -> Optional[str]:
+        if not self.path:
+            return None
+        (secret, algorithm, digits, index) = key
+        name = hashlib.sha256(
+            f"{secret.hex()}-{algorithm}-{digits}".encode()
+        ).hexdigest()
+        return os.path.join(self.path, name[:32], str(index))
+
+    def _load(self, key: Key) -> Optional[List[bytes]]:
+        path = self._file(key)
+        if not path or not os.path.exists(path):
+            return None
+        digits = key[2]
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) != digits * BLOCK_SIZE:
+            return None
+        return [data[i:i + digits] for i in range(0, len(data), digits)]
+
+    def _store(self, key: Key, block: List[bytes]) -> None:
+        path = self._file(key)
+        if not path:
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with NamedTemporaryFile(dir=directory, delete=False) as f:
+            f.write(b"".join(block))
+        os.replace(f.name, path)
@@ -0,0 +1,77 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+import time
+from typing import Dict, List
+
+
+# pseudo reader that reports when readers are added or removed
+PNP_NOTIFICATION = "\\\\?PnP?\\Notification"
+READER_TIMEOUT = 10.0
+
+
+def wait_for_reader(name: str, timeout: float = READER_TIMEOUT) -> str:
+    """
+    Blocks until pcscd reports a reader containing the given name with a
+    card present, and returns the full reader name.  Instead of polling, this
+    waits for reader change notifications from pcscd.  Requires pyscard.
+    """
+    from smartcard.scard import (
+        SCARD_E_NO_READERS_AVAILABLE,
+        SCARD_E_TIMEOUT,
+        SCARD_E_UNKNOWN_READER,
+        SCARD_S_SUCCESS,
+        SCARD_SCOPE_USER,
+        SCARD_STATE_CHANGED,
+        SCARD_STATE_PRESENT,
+        SCARD_STATE_UNAWARE,
+        SCardEstablishContext,
+        SCardGetErrorMessage,
+        SCardGetStatusChange,
+        SCardListReaders,
+        SCardReleaseContext,
+    )
+
+    def check(hresult: int) -> None:
+        if hresult != SCARD_S_SUCCESS:
+            raise RuntimeError(
+                f"PC/SC error: {SCardGetErrorMessage(hresult)}"
+            )
+
+    deadline = time.monotonic() + timeout
+    (hresult, context) = SCardEstablishContext(SCARD_SCOPE_USER)
+    check(hresult)
+    try:
+        states: Dict[str, int] = {PNP_NOTIFICATION: SCARD_STATE_UNAWARE}
+        while True:
+            (hresult, readers) = SCardListReaders(context, [])
+            if hresult == SCARD_E_NO_READERS_AVAILABLE:
+                readers = []
+            else:
+                check(hresult)
+            matching: List[str] = [r for r in readers if name in r]
+            for reader in list(states):
+                if reader != PNP_NOTIFICATION and reader not in readers:
+                    del states[reader]
+            for reader in matching:
+                if states.setdefault(reader, SCARD_STATE_UNAWARE) & \
+                        SCARD_STATE_PRESENT:
+                    return reader
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            (hresult, changes) = SCardGetStatusChange(
+                context, int(remaining * 1000), list(states.items())
+            )
+            if hresult == SCARD_E_TIMEOUT:
+                break
+            if hresult == SCARD_E_UNKNOWN_READER:
+                # a reader was removed while waiting, list them again
+                continue
+            check(hresult)
+            for (reader, event_state, _) in changes:
+                states[reader] = event_state & ~SCARD_STATE_CHANGED
+    finally:
+        SCardReleaseContext(context)
+    raise RuntimeError(f"PC/SC reader {name} does not show up")
@@ -0,0 +1,234 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+import struct
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from types import TracebackType
+from typing import (
+    Any, BinaryIO, Dict, Generator, Iterable, Iterator, List, Optional, Type
+)
+
+from pynitrokey.nk3.secrets_app import Instruction, Tag
+from pynitrokey.trussed.device import App
+
+from .benchmark import Samples
+
+
+# trace files start with this magic value, including the format version
+TRACE_MAGIC = b"NKTRACE\x01"
+# timestamp, duration, app, request length, response length
+RECORD = struct.Struct("<ddBII")
+SELECT = 0xA4
+# tags of the Select response that differ between devices and sessions:
+# version, salt, challenge and serial number
+SELECT_MASKED_TAGS = {
+    Tag.Version.value,
+    Tag.CredentialId.value,
+    Tag.Challenge.value,
+    Tag.SerialNumber.value,
+}
+
+
+def is_select(request: bytes) -> bool:
+    return len(request) >= 4 and request[1] == SELECT and request[2] == 0x04
+
+
+def comparable_response(request: bytes, response: bytes) -> bytes:
+    """
+    Returns the response without the values that are expected to change
+    between runs.  For Select, the values of the TLVs in SELECT_MASKED_TAGS
+    are removed, keeping the status word and the other TLVs.
+    """
+    if not is_select(request):
+        return response
+    result = bytearray(response[:2])
+    data = response[2:]
+    i = 0
+    while i < len(data):
+        if i + 2 > len(data) or i + 2 + data[i + 1] > len(data):
+            # not a TLV structure, only compare the status word
+            return bytes(response[:2])
+        (tag, length) = (data[i], data[i + 1])
+        if tag in SELECT_MASKED_TAGS:
+            result += bytes([tag])
+        else:
+            result += data[i:i + 2 + length]
+        i += 2 + length
+    return bytes(result)
+
+
+def instruction_name(request: bytes) -> str:
+    """
+    Returns the Secrets App instruction name for the given APDU.
+    """
+    if len(request) < 4:
+        return "[invalid]"
+    (ins, p1) = (request[1], request[2])
+    if ins == SELECT and p1 == 0x04:
+        return "Select"
+    try:
+        return str(Instruction(ins).name)
+    except ValueError:
+        return f"0x{ins:02x}"
+
+
+@dataclass
+class Exchange:
+    # seconds since the start of the recording
+    timestamp: float
+    duration: float
+    app: int
+    request: bytes
+    response: bytes
+
+    @property
+    def status(self) -> bytes:
+        # the CTAPHID bridge returns the status word before the data
+        return self.response[:2]
+
+    @property
+    def name(self) -> str:
+        return instruction_name(self.request)
+
+
+class Recorder:
+    """
+    Writes all commands sent with `_call_app` to a trace file, together with
+    the response and the duration of the exchange.
+    """
+    def __init__(self, path: str) -> None:
+        self.file: BinaryIO = open(path, "wb")
+        self.file.write(TRACE_MAGIC)
+        self.start = time.perf_counter()
+
+    def __enter__(self) -> "Recorder":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def record(self, exchange: Exchange) -> None:
+        self.file.write(RECORD.pack(
+            exchange.timestamp,
+            exchange.duration,
+            exchange.app,
+            len(exchange.request),
+            len(exchange.response),
+        ))
+        self.file.write(exchange.request)
+        self.file.write(exchange.response)
+
+    @contextmanager
+    def attach(self, dev: Any) -> Generator[None, None, None]:
+        """
+        Records the exchanges of the given device while the context is
+        active.
+        """
+        original = vars(dev).get("_call_app")
+        call_app = dev._call_app
+
+        def recording_call_app(
+            app: App, response_len: Optional[int] = None, data: bytes = b""
+        ) -> bytes:
+            start = time.perf_counter()
+            response: bytes = call_app(app, response_len, data)
+            end = time.perf_counter()
+            self.record(Exchange(
+                start - self.start, end - start, app.value, data, response
+            ))
+            return response
+
+        setattr(dev, "_call_app", recording_call_app)
+        try:
+            yield
+        finally:
+            if original:
+                setattr(dev, "_call_app", original)
+            else:
+                delattr(dev, "_call_app")
+
+
+def read_trace(path: str) -> Iterator[Exchange]:
+    with open(path, "rb") as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{path} is not an APDU trace file")
+        while True:
+            header = f.read(RECORD.size)
+            if not header:
+                break
+            if len(header) != RECORD.size:
+                raise ValueError(f"{path} is truncated")
+            (timestamp, duration, app, request_len, response_len) = \
+                RECORD.unpack(header)
+            request = f.read(request_len)
+            response = f.read(response_len)
+            if len(response) != response_len:
+                raise ValueError(f"{path} is truncated")
+            yield Exchange(timestamp, duration, app, request, response)
+
+
+@dataclass
+class Mismatch:
+    index: int
+    expected: Exchange
+    response: bytes
+
+
+@dataclass
+class Replay:
+    mismatches: List[Mismatch] = field(default_factory=list)
+    # durations per instruction name, as recorded and as replayed
+    recorded: Dict[str, Samples] = field(
+        default_factory=lambda: defaultdict(Samples)
+    )
+    replayed: Dict[str, Samples] = field(
+        default_factory=lambda: defaultdict(Samples)
+    )
+
+    def latency_shifts(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the change of the median duration per instruction, in seconds
+        and relative to the recording.
+        """
+        shifts = {}
+        for name, samples in sorted(self.replayed.items()):
+            before = self.recorded[name].summary()["p50"]
+            after = samples.summary()["p50"]
+            shifts[name] = {
+                "recorded": before,
+                "replayed": after,
+                "shift": after - before,
+                "ratio": after / before if before else 0.0,
+            }
+        return shifts
+
+
+def replay(dev: Any, trace: Iterable[Exchange]) -> Replay:
+    """
+    Sends the requests of the given trace to the device without delay and
+    compares the responses with the recorded responses, see
+    `comparable_response`.  The device must be in the same state as the
+    device used for the recording.
+    """
+    result = Replay()
+    for (i, exchange) in enumerate(trace):
+        start = time.perf_counter()
+        response = dev._call_app(App(exchange.app), data=exchange.request)
+        duration = time.perf_counter() - start
+        result.recorded[exchange.name].add(exchange.duration)
+        result.replayed[exchange.name].add(duration)
+        if comparable_response(exchange.request, response) != \
+                comparable_response(exchange.request, exchange.response):
+            result.mismatches.append(Mismatch(i, exchange, response))
+    return result
@@ -0,0 +1,556 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+import logging
+import secrets
+import struct
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import (
+    Any, Callable, Dict, Generator, List, Optional, Sequence, Set, Tuple,
+    Union
+)
+
+from fido2.hid import open_device
+from pynitrokey.nk3.device import Nitrokey3Device
+from pynitrokey.nk3.secrets_app import (
+    Instruction, RawBytes, SecretsApp, SecretsAppException, Tag
+)
+from pynitrokey.trussed.device import App
+
+from . import tracing
+from .benchmark import Samples
+from .device import Device
+
+
+logger = logging.getLogger(__name__)
+
+
+STATUS_OK = b"\x90\x00"
+# first byte of the status word if more data is available
+STATUS_MORE_DATA = 0x61
+# returned while the brute-force protection delays verifications
+STATUS_SECURITY_STATUS_NOT_SATISFIED = b"\x69\x82"
+# CalculateAll response tag for a code, see the YKOATH protocol
+TAG_TRUNCATED_RESPONSE = 0x76
+# number of reverse HOTP verification commands encoded in advance
+BRUTEFORCE_BATCH = 1000
+# instructions that decrypt or encrypt credential data
+ENCRYPTION_INSTRUCTIONS = {
+    "Put",
+    "Calculate",
+    "CalculateAll",
+    "GetCredential",
+    "UpdateCredential",
+    "VerifyCode",
+}
+PROFILE_CATEGORIES = ["verify_pin", "encryption", "other"]
+# YubiKey-compatible API request instruction, used for challenge-response
+YK_API_REQ = 0x01
+# P1 values for the challenge-response with the two HMAC slots
+YK_P1_CMD_HMAC_1 = 0x30
+YK_P1_CMD_HMAC_2 = 0x38
+# credential names of the HMAC slots
+YK_HMAC_SLOTS = {
+    b"HmacSlot1": YK_P1_CMD_HMAC_1,
+    b"HmacSlot2": YK_P1_CMD_HMAC_2,
+}
+
+
+@contextmanager
+def open_secrets_app(
+    device: Device, logfn: Optional[Callable[[str], None]] = None
+) -> Generator[SecretsApp, None, None]:
+    """
+    Opens a Secrets App client for the given device.  Can be used instead of
+    the dev fixture if the device is restarted during the test.
+    """
+    nk3 = Nitrokey3Device.open(f"/dev/{device.hidraw}")
+    if not nk3:
+        raise RuntimeError(f"could not open {device.hidraw}")
+    try:
+        yield SecretsApp(nk3, logfn=logfn)
+    finally:
+        nk3.close()
+
+
+def reconnect(nk3: Nitrokey3Device, device: Device) -> None:
+    """
+    Connects an open client to the current hidraw device of the given device,
+    for example after the runner was restarted by `UsbipDevice.restore`.
+    """
+    try:
+        nk3.close()
+    except OSError:
+        pass
+    nk3.device = open_device(f"/dev/{device.hidraw}")
+    nk3._path = f"/dev/{device.hidraw}"
+
+
+@contextmanager
+def capture_apdus(app: SecretsApp) -> Generator[List[bytes], None, None]:
+    """
+    Captures the APDUs that the Secrets App client would send instead of
+    sending them to the device.  The captured commands receive an empty
+    success response.
+    """
+    apdus: List[bytes] = []
+    original = vars(app).get("_send_receive_inner")
+
+    def send_receive_inner(data: bytes, log_info: str = "") -> bytes:
+        apdus.append(data)
+        return b""
+
+    setattr(app, "_send_receive_inner", send_receive_inner)
+    try:
+        yield apdus
+    finally:
+        if original:
+            setattr(app, "_send_receive_inner", original)
+        else:
+            delattr(app, "_send_receive_inner")
+
+
+@contextmanager
+def time_instructions(
+    app: SecretsApp,
+) -> Generator[Dict[str, Samples], None, None]:
+    """
+    Records the duration of all successful commands sent by the Secrets App
+    client, grouped by the instruction name.  The duration includes the
+    SendRemaining requests needed to receive the full response.
+    """
+    samples: Dict[str, Samples] = defaultdict(Samples)
+    original = vars(app).get("_send_receive")
+    send_receive = app._send_receive
+
+    def timed_send_receive(ins: Any, structure: Any = None) -> bytes:
+        start = time.perf_counter()
+        result = send_receive(ins, structure)
+        samples[ins.name].add(time.perf_counter() - start)
+        return result
+
+    setattr(app, "_send_receive", timed_send_receive)
+    try:
+        yield samples
+    finally:
+        if original:
+            setattr(app, "_send_receive", original)
+        else:
+            delattr(app, "_send_receive")
+
+
+def encode(app: SecretsApp, f: Callable[[], Any]) -> List[bytes]:
+    """
+    Returns the APDUs sent by the given call of the Secrets App client.
+    Calls that are disabled by the test fixtures, like verify_pin_raw for
+    hardware-based encryption, do not produce any APDUs.
+    """
+    with capture_apdus(app) as apdus:
+        f()
+    return apdus
+
+
+def send_receive_ins(
+    app: SecretsApp,
+    ins: Union[int, Instruction],
+    structure: Optional[Sequence[Any]] = None,
+    p1: Optional[int] = None,
+    le: Optional[int] = None,
+    data_raw: bytes = b"",
+    expected_SW: Optional[str] = "9000",
+) -> Tuple[bytes, bytes]:
+    """
+    Sends a command directly to the CTAP bridge and returns the status word
+    and the response data.  If `ins` is an int, it is used verbatim together
+    with `p1`, otherwise the default encoding of the instruction is used.
+    The command data is encoded from the TLV entries in `structure`, or
+    taken from `data_raw` if `structure` is None.  If `expected_SW` is set,
+    the status word is checked before returning.
+    """
+    from pynitrokey.start.gnuk_token import iso7816_compose
+
+    p2 = 0
+    p1 = 0 if p1 is None else p1
+    if isinstance(ins, int):
+        ins_b = ins
+    else:
+        ins_b, p1, p2 = app._encode_command(ins)
+    data_to_send = (
+        app._custom_encode(structure) if structure is not None else data_raw
+    )
+    data = iso7816_compose(ins_b, p1, p2, data_to_send, le=le)
+    with tracing.span(
+        logger, "send_receive", ins=ins_b, request=data
+    ) as span:
+        res = app.dev._call_app(App.SECRETS, data=data)
+        span.set(response=res)
+    status_bytes, result = res[:2], res[2:]
+
+    if expected_SW:
+        assert status_bytes.hex() == expected_SW
+    return status_bytes, result
+
+
+def get_padded(challenge: bytes, length: int = 64) -> bytes:
+    """
+    Returns the PKCS#7 padded challenge, as sent by KeepassXC.
+    """
+    from cryptography.hazmat.primitives import padding
+
+    # The value passed here is in bits
+    padder = padding.PKCS7(length * 8).padder()
+    return padder.update(challenge) + padder.finalize()
+
+
+@dataclass
+class BulkRegistration:
+    registered: List[bytes] = field(default_factory=list)
+    # duration of the register command for every registered credential
+    latencies: List[float] = field(default_factory=list)
+    # status of the first failed register command, if any
+    status: Optional[bytes] = None
+
+
+def bulk_register(
+    app: SecretsApp, credentials: Sequence[Dict[str, Any]], pin: str
+) -> BulkRegistration:
+    """
+    Registers the given credentials, passing each dict as keyword arguments
+    to `SecretsApp.register`, until the first registration fails.  All
+    commands are encoded before the first one is sent, and the commands are
+    sent directly to the device without logging to keep the host overhead
+    between two registrations low.
+    """
+    commands = []
+    for kwargs in credentials:
+        verify = encode(app, lambda: app.verify_pin_raw(pin))
+        register = encode(app, lambda: app.register(**kwargs))
+        commands.append((kwargs["credid"], verify, register))
+
+    result = BulkRegistration()
+    call = app.dev._call_app
+    for (name, verify, register) in commands:
+        for apdu in verify:
+            response = call(App.SECRETS, data=apdu)
+            if response[:2] != STATUS_OK:
+                result.status = response[:2]
+                return result
+        latency = 0.0
+        for apdu in register:
+            start = time.perf_counter()
+            response = call(App.SECRETS, data=apdu)
+            latency += time.perf_counter() - start
+            if response[:2] != STATUS_OK:
+                result.status = response[:2]
+                return result
+        result.registered.append(name)
+        result.latencies.append(latency)
+    return result
+
+
+def _decode_tlv(data: bytes) -> List[Tuple[int, bytes]]:
+    entries = []
+    i = 0
+    while i + 2 <= len(data):
+        (tag, length) = (data[i], data[i + 1])
+        entries.append((tag, data[i + 2:i + 2 + length]))
+        i += 2 + length
+    if i != len(data):
+        raise ValueError("invalid TLV data")
+    return entries
+
+
+def calculate_all(
+    app: SecretsApp, challenge: int
+) -> Dict[bytes, Optional[bytes]]:
+    """
+    Calculates the codes of all credentials with the CalculateAll command.
+    Credentials without a code in the response, like HOTP credentials or
+    credentials that require touch, are returned with None.
+    """
+    structure = [
+        RawBytes([Tag.Challenge.value, 8, *struct.pack(">Q", challenge)])
+    ]
+    response = app._send_receive(Instruction.CalculateAll, structure)
+    entries = _decode_tlv(response)
+    codes: Dict[bytes, Optional[bytes]] = {}
+    for i in range(0, len(entries) - 1, 2):
+        ((name_tag, name), (tag, value)) = entries[i:i + 2]
+        if name_tag != Tag.CredentialId.value:
+            raise ValueError(f"unexpected tag {name_tag:#x} in response")
+        if tag == TAG_TRUNCATED_RESPONSE:
+            digits = value[0]
+            truncated = int.from_bytes(value[1:], "big") & 0x7FFFFFFF
+            codes[name] = str(truncated % 10**digits).zfill(digits).encode()
+        else:
+            codes[name] = None
+    return codes
+
+
+@dataclass
+class ChainedResponse:
+    # duration of the command and every SendRemaining request
+    frames: List[float] = field(default_factory=list)
+    size: int = 0
+    status: bytes = b""
+
+    @property
+    def duration(self) -> float:
+        return sum(self.frames)
+
+
+def chained_list(
+    app: SecretsApp, version: Optional[int] = None
+) -> ChainedResponse:
+    """
+    Sends a List command, with the given version for the extended list, and
+    receives the full response with SendRemaining requests.  Returns the
+    duration of every frame.
+    """
+    structure = [RawBytes([version])] if version is not None else None
+    (command,) = encode(
+        app, lambda: app._send_receive(Instruction.List, structure)
+    )
+    (send_remaining,) = encode(
+        app, lambda: app._send_receive(Instruction.SendRemaining)
+    )
+
+    result = ChainedResponse()
+    call = app.dev._call_app
+    apdu = command
+    while True:
+        start = time.perf_counter()
+        response = call(App.SECRETS, data=apdu)
+        result.frames.append(time.perf_counter() - start)
+        result.status = response[:2]
+        result.size += len(response) - 2
+        if result.status[0] != STATUS_MORE_DATA:
+            return result
+        apdu = send_remaining
+
+
+@dataclass
+class BruteForce:
+    # verifications evaluated by the device
+    attempts: int = 0
+    # verifications rejected because of the brute-force protection delay
+    rejected: int = 0
+    duration: float = 0.0
+    found: Optional[int] = None
+
+    @property
+    def rate(self) -> float:
+        return self.attempts / self.duration if self.duration else 0.0
+
+
+def bruteforce_reverse_hotp(
+    app: SecretsApp, cred_id: bytes, duration: float, start: int = 0
+) -> BruteForce:
+    """
+    Sends reverse HOTP verification requests for consecutive codes to the
+    device for the given duration.  The commands are encoded in advance so
+    that the host overhead does not limit the rate.  The credential must not
+    require the PIN.
+    """
+    apdus = []
+    for code in range(start, start + BRUTEFORCE_BATCH):
+        (apdu,) = encode(app, lambda: app.verify_code(cred_id, code))
+        apdus.append((code, apdu))
+
+    result = BruteForce()
+    call = app.dev._call_app
+    begin = time.perf_counter()
+    deadline = begin + duration
+    while time.perf_counter() < deadline:
+        for (code, apdu) in apdus:
+            status = call(App.SECRETS, data=apdu)[:2]
+            if status == STATUS_SECURITY_STATUS_NOT_SATISFIED:
+                result.rejected += 1
+            else:
+                result.attempts += 1
+                if status == STATUS_OK and result.found is None:
+                    result.found = code
+            if time.perf_counter() >= deadline:
+                break
+    result.duration = time.perf_counter() - begin
+    return result
+
+
+class CredentialNamespace:
+    """
+    Prefixes all credential names used with a Secrets App client so that a
+    test only sees its own credentials, see `credential_namespace`.
+    """
+    def __init__(self, prefix: bytes) -> None:
+        self.prefix = prefix
+        # full names of the credentials registered in this namespace
+        self.registered: Set[bytes] = set()
+
+    def encode(self, name: Union[str, bytes]) -> bytes:
+        if isinstance(name, str):
+            name = name.encode()
+        return self.prefix + name
+
+    def decode(self, name: bytes) -> Optional[bytes]:
+        if not name.startswith(self.prefix):
+            return None
+        return name[len(self.prefix):]
+
+    def install(self, app: SecretsApp) -> None:
+        register = app.register
+        update_credential = app.update_credential
+        calculate = app.calculate
+        verify_code = app.verify_code
+        delete = app.delete
+        get_credential = app.get_credential
+        list_credentials = app.list
+        list_with_properties = app.list_with_properties
+
+        def ns_register(credid: Union[str, bytes], *args: Any,
+                        **kwargs: Any) -> None:
+            name = self.encode(credid)
+            register(name, *args, **kwargs)
+            self.registered.add(name)
+
+        def ns_update_credential(
+            cred_id: Union[str, bytes],
+            new_name: Optional[Union[str, bytes]] = None,
+            **kwargs: Any,
+        ) -> None:
+            name = self.encode(cred_id)
+            if new_name:
+                new = self.encode(new_name)
+                update_credential(name, new, **kwargs)
+                self.registered.discard(name)
+                self.registered.add(new)
+            else:
+                update_credential(name, **kwargs)
+
+        def ns_delete(cred_id: Union[str, bytes]) -> None:
+            name = self.encode(cred_id)
+            delete(name)
+            self.registered.discard(name)
+
+        def ns_get_credential(cred_id: Union[str, bytes]) -> Any:
+            entry = get_credential(self.encode(cred_id))
+            if entry.name:
+                entry = replace(entry, name=self.decode(entry.name))
+            return entry
+
+        def ns_list(extended: bool = False) -> List[Any]:
+            result: List[Any] = []
+            item: Any
+            for item in list_credentials(extended):
+                if extended:
+                    (kind, full_name) = item
+                    name = self.decode(full_name)
+                    if name is not None:
+                        result.append((kind, name))
+                else:
+                    name = self.decode(item)
+                    if name is not None:
+                        result.append(name)
+            return result
+
+        def ns_list_with_properties(version: int = 1) -> List[Any]:
+            result = []
+            for item in list_with_properties(version):
+                name = self.decode(item.label)
+                if name is not None:
+                    result.append(replace(item, label=name))
+            return result
+
+        setattr(app, "register", ns_register)
+        setattr(app, "update_credential", ns_update_credential)
+        setattr(app, "rename_credential", lambda cred_id, new_name:
+                ns_update_credential(cred_id, new_name))
+        setattr(app, "calculate", lambda cred_id, challenge=None:
+                calculate(self.encode(cred_id), challenge))
+        setattr(app, "verify_code", lambda cred_id, code:
+                verify_code(self.encode(cred_id), code))
+        setattr(app, "delete", ns_delete)
+        setattr(app, "get_credential", ns_get_credential)
+        setattr(app, "list", ns_list)
+        setattr(app, "list_with_properties", ns_list_with_properties)
+
+
+@contextmanager
+def credential_namespace(
+    app: SecretsApp,
+    verify_pin: Callable[[], None],
+    prefix: Optional[bytes] = None,
+) -> Generator[CredentialNamespace, None, None]:
+    """
+    Installs a credential namespace with the given or a random prefix on the
+    Secrets App client.  When the context exits, all credentials registered
+    in the namespace are deleted again, calling `verify_pin` before every
+    deletion.  Credentials that cannot be deleted are logged as leaked.
+    """
+    if prefix is None:
+        prefix = secrets.token_hex(3).encode() + b"."
+    namespace = CredentialNamespace(prefix)
+    delete = app.delete
+    namespace.install(app)
+    try:
+        yield namespace
+    finally:
+        leaked = []
+        for name in sorted(namespace.registered):
+            try:
+                verify_pin()
+                delete(name)
+            except SecretsAppException:
+                leaked.append(name)
+        if leaked:
+            logger.warning(f"could not delete credentials: {leaked}")
+
+
+def profile_category(instruction: str) -> str:
+    if instruction == "VerifyPIN":
+        return "verify_pin"
+    if instruction in ENCRYPTION_INSTRUCTIONS:
+        return "encryption"
+    return "other"
+
+
+class EncryptionProfile:
+    """
+    Collects the time spent in the Secrets App commands of every test per
+    credential encryption mode, split into PIN verification, commands that
+    use encrypted credential data and other commands.
+    """
+    def __init__(self) -> None:
+        # mode -> category -> command durations
+        self.commands: Dict[str, Dict[str, Samples]] = defaultdict(
+            lambda: defaultdict(Samples)
+        )
+        # mode -> number of tests
+        self.tests: Dict[str, int] = defaultdict(int)
+
+    def add(self, mode: str, samples: Dict[str, Samples]) -> None:
+        self.tests[mode] += 1
+        for instruction, durations in samples.items():
+            category = profile_category(instruction)
+            for duration in durations.values:
+                self.commands[mode][category].add(duration)
+
+    def table(self) -> List[str]:
+        lines = [
+            f"{'mode':<16}{'category':<12}{'commands':>10}{'total [s]':>12}"
+            f"{'per cmd [ms]':>14}{'per test [ms]':>15}"
+        ]
+        for mode in sorted(self.tests):
+            tests = self.tests[mode]
+            for category in PROFILE_CATEGORIES:
+                values = self.commands[mode][category].values
+                total = sum(values)
+                per_command = total / len(values) * 1000 if values else 0.0
+                lines.append(
+                    f"{mode:<16}{category:<12}{len(values):>10}"
+                    f"{total:>12.2f}{per_command:>14.2f}"
+                    f"{total / tests * 1000:>15.2f}"
+                )
+        return lines
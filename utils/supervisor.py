@@ -0,0 +1,202 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+import gzip
+import logging
+import os
+import os.path
+import signal
+import threading
+from collections import deque
+from contextlib import contextmanager
+from subprocess import Popen
+from types import FrameType
+from typing import Deque, Generator, List, Optional, Set
+
+from fido2.hid import open_device
+
+
+logger = logging.getLogger(__name__)
+
+
+# number of runner output lines included in crash reports
+RUNNER_LOG_LINES = 50
+# number of runner output lines kept per test for failure reports
+RUNNER_TEST_LINES = 2000
+PING_DATA = b"nitrokey-3-tests"
+PING_TIMEOUT = 2.0
+
+# crash that is raised in the main thread by the SIGUSR2 handler
+_pending: Optional["RunnerCrashed"] = None
+# only raise crashes while a test is executed
+_armed = False
+
+
+# derived from BaseException so that it is not caught by the broad exception
+# handlers in the tests and helpers, like KeyboardInterrupt
+class RunnerCrashed(BaseException):
+    def __init__(self, reason: str, lines: List[str]) -> None:
+        message = f"usbip-runner {reason}"
+        if lines:
+            message += ", last output:\n" + "\n".join(lines)
+        super().__init__(message)
+        self.reason = reason
+        self.lines = lines
+
+
+def _raise_pending(signum: int, frame: Optional[FrameType]) -> None:
+    global _pending
+    crash = _pending
+    _pending = None
+    if crash and _armed:
+        raise crash
+
+
+def install_signal_handler() -> None:
+    """
+    Installs the SIGUSR2 handler that fails the current test when a
+    supervisor detects a crash.  Must be called from the main thread.
+    """
+    signal.signal(signal.SIGUSR2, _raise_pending)
+
+
+@contextmanager
+def fail_fast() -> Generator[None, None, None]:
+    """
+    Raises `RunnerCrashed` in the current test if a supervised runner stops
+    unexpectedly while the context is active.
+    """
+    global _armed
+    _armed = True
+    try:
+        yield
+    finally:
+        _armed = False
+
+
+class Supervisor:
+    """
+    Watches a runner process in a background thread.  The output of the
+    runner is written to a compressed log file in `log_dir`, if set, and the
+    last lines are kept in memory for crash and failure reports.  If the
+    runner exits without `expect_exit` being called, the crash is stored in
+    `crashed` and raised in the main thread, see `fail_fast`.
+    """
+    def __init__(self, name: str, log_dir: Optional[str] = None) -> None:
+        self.name = name
+        self.log_dir = log_dir
+        self.log_path: Optional[str] = None
+        self.lines: Deque[str] = deque(maxlen=RUNNER_LOG_LINES)
+        # output since the last call of start_test
+        self.test_lines: Deque[str] = deque(maxlen=RUNNER_TEST_LINES)
+        self.line_count = 0
+        self._test_start = 0
+        self.crashed: Optional[RunnerCrashed] = None
+        self.crashes_expected = False
+        # PIDs of runners that are stopped on purpose
+        self._exit_expected: Set[int] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, runner: "Popen[bytes]") -> None:
+        self._thread = threading.Thread(
+            target=self._run, args=(runner,), daemon=True
+        )
+        self._thread.start()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        """
+        Waits until the output of the current runner is read completely.
+        """
+        if self._thread:
+            self._thread.join(timeout)
+
+    def expect_exit(self, runner: "Popen[bytes]") -> None:
+        self._exit_expected.add(runner.pid)
+
+    @contextmanager
+    def expect_crashes(self) -> Generator[None, None, None]:
+        """
+        Disables the crash handling, for example for fuzzing.
+        """
+        self.crashes_expected = True
+        try:
+            yield
+        finally:
+            self.crashes_expected = False
+
+    def start_test(self) -> None:
+        self.test_lines.clear()
+        self._test_start = self.line_count
+
+    def test_log(self) -> str:
+        """
+        Returns the output of the runner since the last call of `start_test`.
+        If it exceeds the ring buffer, the oldest lines are omitted.
+        """
+        omitted = self.line_count - self._test_start - len(self.test_lines)
+        lines = list(self.test_lines)
+        if omitted > 0:
+            lines.insert(0, f"[{omitted} lines omitted, see {self.log_path}]")
+        return "\n".join(lines)
+
+    def _open_log(self, runner: "Popen[bytes]") -> Optional[gzip.GzipFile]:
+        if not self.log_dir:
+            return None
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.log_path = os.path.join(
+            self.log_dir, f"{self.name}-{runner.pid}.log.gz"
+        )
+        # the lowest compression level keeps the overhead for verbose logs
+        # small
+        return gzip.open(self.log_path, "wb", compresslevel=1)
+
+    def _run(self, runner: "Popen[bytes]") -> None:
+        log = self._open_log(runner)
+        try:
+            if runner.stdout:
+                for raw_line in runner.stdout:
+                    line = raw_line.decode(errors="replace").rstrip()
+                    self.lines.append(line)
+                    self.test_lines.append(line)
+                    self.line_count += 1
+                    if log:
+                        log.write(raw_line)
+        finally:
+            if log:
+                log.close()
+        returncode = runner.wait()
+        if runner.pid in self._exit_expected or self.crashes_expected:
+            return
+        self.report(
+            RunnerCrashed(f"exited with {returncode}", list(self.lines))
+        )
+
+    def report(self, crash: RunnerCrashed) -> None:
+        global _pending
+        logger.error(f"{self.name}: {crash.reason}")
+        self.crashed = crash
+        _pending = crash
+        os.kill(os.getpid(), signal.SIGUSR2)
+
+    def probe(self, hidraw: str, timeout: float = PING_TIMEOUT) -> bool:
+        """
+        Sends a CTAPHID ping to the runner and returns True if it responds
+        within the timeout.
+        """
+        result: List[bool] = []
+
+        def ping() -> None:
+            try:
+                device = open_device(f"/dev/{hidraw}")
+                try:
+                    result.append(device.ping(PING_DATA) == PING_DATA)
+                finally:
+                    device.close()
+            except Exception as e:
+                logger.debug(f"{self.name}: ping failed: {e}")
+                result.append(False)
+
+        thread = threading.Thread(target=ping, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        return bool(result) and result[0]
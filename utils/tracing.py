@@ -0,0 +1,222 @@
+# Copyright (C) 2026 Nitrokey GmbH
+# SPDX-License-Identifier: CC0-1.0
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from types import TracebackType
+from typing import Any, Dict, Generator, List, Optional, Type, Union
+
+from pynitrokey.trussed.device import App
+
+
+# maximum length of values in log messages
+MAX_LOG_VALUE = 100
+
+_tracer: Optional["Tracer"] = None
+
+
+class Tracer:
+    """
+    Collects spans and events in the Chrome trace event format.  The trace
+    can be opened with chrome://tracing or https://ui.perfetto.dev.
+    """
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+        self.events: List[Dict[str, Any]] = []
+
+    def timestamp(self, t: float) -> float:
+        # microseconds since the start of the trace
+        return (t - self.start) * 1_000_000
+
+    def add(
+        self,
+        phase: str,
+        category: str,
+        name: str,
+        start: float,
+        args: Dict[str, Any],
+        duration: Optional[float] = None,
+    ) -> None:
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": phase,
+            "ts": self.timestamp(start),
+            "pid": self.pid,
+            "tid": threading.get_native_id(),
+            "args": {k: _json_value(v) for (k, v) in args.items()},
+        }
+        if duration is not None:
+            event["dur"] = duration * 1_000_000
+        self.events.append(event)
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(
+                {"traceEvents": self.events, "displayTimeUnit": "ms"}, f
+            )
+
+
+def start() -> Tracer:
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop() -> Optional[Tracer]:
+    global _tracer
+    tracer = _tracer
+    _tracer = None
+    return tracer
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _evaluate(args: Dict[str, Any]) -> Dict[str, Any]:
+    # callables are only evaluated if the event is recorded or logged
+    return {k: v() if callable(v) else v for (k, v) in args.items()}
+
+
+def _format(name: str, args: Dict[str, Any]) -> str:
+    values = []
+    for (k, v) in args.items():
+        s = str(_json_value(v))
+        if len(s) > MAX_LOG_VALUE:
+            s = s[:MAX_LOG_VALUE] + ".."
+        values.append(f"{k}={s}")
+    if not values:
+        return name
+    return f"{name}: {', '.join(values)}"
+
+
+def event(logger: logging.Logger, name: str, **args: Any) -> None:
+    """
+    Records an instant event and logs it with level DEBUG.  Argument values
+    can be callables that are only evaluated if the event is recorded or
+    logged.
+    """
+    tracer = _tracer
+    log = logger.isEnabledFor(logging.DEBUG)
+    if tracer is None and not log:
+        return
+    evaluated = _evaluate(args)
+    if tracer:
+        tracer.add("i", logger.name, name, time.perf_counter(), evaluated)
+    if log:
+        logger.debug(_format(name, evaluated))
+
+
+class Span:
+    def __init__(
+        self,
+        tracer: Optional[Tracer],
+        logger: logging.Logger,
+        name: str,
+        args: Dict[str, Any],
+    ) -> None:
+        self.tracer = tracer
+        self.logger = logger
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def set(self, **args: Any) -> None:
+        """
+        Adds arguments to the span, for example the result of an operation.
+        """
+        self.args.update(args)
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        duration = time.perf_counter() - self.start
+        args = _evaluate(self.args)
+        if exc_val is not None:
+            args["error"] = repr(exc_val)
+        if self.tracer:
+            self.tracer.add(
+                "X", self.logger.name, self.name, self.start, args, duration
+            )
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                f"{_format(self.name, args)} ({duration * 1000:.2f} ms)"
+            )
+
+
+class _NoSpan:
+    def set(self, **args: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(
+    logger: logging.Logger, name: str, **args: Any
+) -> Union[Span, _NoSpan]:
+    """
+    Returns a context manager that records the duration of the enclosed
+    block as a span and logs it with level DEBUG, see `event`.  If tracing
+    and debug logging are disabled, a shared no-op context is returned.
+    """
+    tracer = _tracer
+    if tracer is None and not logger.isEnabledFor(logging.DEBUG):
+        return _NO_SPAN
+    return Span(tracer, logger, name, args)
+
+
+@contextmanager
+def trace_call_app(
+    dev: Any, logger: logging.Logger
+) -> Generator[None, None, None]:
+    """
+    Records a span with the request and response for every command sent with
+    `_call_app` while the context is active.  Does nothing if tracing is
+    disabled.
+    """
+    if _tracer is None:
+        yield
+        return
+    original = vars(dev).get("_call_app")
+    call_app = dev._call_app
+
+    def traced_call_app(
+        app: App, response_len: Optional[int] = None, data: bytes = b""
+    ) -> bytes:
+        with span(logger, "call_app", app=app.name, request=data) as s:
+            response: bytes = call_app(app, response_len, data)
+            s.set(response=response)
+        return response
+
+    setattr(dev, "_call_app", traced_call_app)
+    try:
+        yield
+    finally:
+        if original:
+            setattr(dev, "_call_app", original)
+        else:
+            delattr(dev, "_call_app")
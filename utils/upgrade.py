@@ -1,15 +1,57 @@
 # Copyright (C) 2022 Nitrokey GmbH
 # SPDX-License-Identifier: CC0-1.0
 
+import hashlib
+import logging
+import os
+import os.path
+import pickle
+import re
+import shutil
+import time
 from abc import ABC, abstractmethod
 from contextlib import contextmanager
-from typing import Generator, Generic, TypeVar
-from .device import Device, spawn_device
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory, mkdtemp
+from typing import (
+    Any, Generator, Generic, Optional, Sequence, Tuple, TypeVar, cast
+)
+from .device import Device, get_binary, get_free_blocks, spawn_device
+from .supervisor import RunnerCrashed
 
 
+logger = logging.getLogger(__name__)
+
 Context = TypeVar("Context")
 State = TypeVar("State")
 
+UPGRADE_CACHE_PATH = "./cache/upgrade"
+
+
+@dataclass
+class UpgradeStats:
+    """
+    The cost of the first boot of the new firmware on the state prepared with
+    the old firmware, e. g. caused by filesystem migrations.  Boot times are
+    measured until the device is enumerated.  Free blocks are (int, ext)
+    tuples as reported by the device status, or None if the firmware does
+    not report them.
+    """
+    fresh_boot_time: float
+    upgrade_boot_time: float
+    verify_time: float
+    free_blocks_before: Optional[Tuple[int, int]]
+    free_blocks_after: Optional[Tuple[int, int]]
+
+    @property
+    def free_blocks_delta(self) -> Optional[Tuple[int, int]]:
+        if self.free_blocks_before is None or self.free_blocks_after is None:
+            return None
+        return (
+            self.free_blocks_after[0] - self.free_blocks_before[0],
+            self.free_blocks_after[1] - self.free_blocks_before[1],
+        )
+
 
 class UpgradeTest(ABC, Generic[Context, State]):
     """
@@ -38,6 +80,19 @@ class UpgradeTest(ABC, Generic[Context, State]):
     def reset(self) -> None:
         pass
 
+    def dump_state(self, state: State) -> bytes:
+        """
+        Serializes the state returned by `prepare`.  The attributes of the
+        test instance are stored too as `verify` may depend on values that
+        are generated in the constructor, for example a random PIN.
+        """
+        return pickle.dumps((vars(self), state))
+
+    def load_state(self, data: bytes) -> State:
+        (attrs, state) = pickle.loads(data)
+        vars(self).update(attrs)
+        return cast(State, state)
+
     def run(self, device: Device) -> None:
         try:
             with self.context(device) as context:
@@ -46,21 +101,139 @@ class UpgradeTest(ABC, Generic[Context, State]):
         finally:
             self.reset()
 
-    def run_upgrade(self, serial: str, ifs: str, efs: str) -> None:
+    def prepare_upgrade(self, serial: str, ifs: str, efs: str) -> State:
+        with spawn_device(
+            serial=serial, ifs=ifs, efs=efs, suffix="old",
+        ) as device:
+            with self.context(device) as context:
+                return self.prepare(context)
+
+    def verify_upgrade(
+        self,
+        serial: str,
+        ifs: str,
+        efs: str,
+        state: State,
+        binary: Optional[str] = None,
+    ) -> None:
+        with spawn_device(
+            serial=serial, ifs=ifs, efs=efs, provision=False, binary=binary,
+        ) as device:
+            with self.context(device) as context:
+                self.verify(context, state)
+
+    def run_upgrade(
+        self,
+        serial: str,
+        ifs: str,
+        efs: str,
+        cache: Optional["CacheEntry"] = None,
+    ) -> None:
+        try:
+            if cache and cache.exists:
+                (serial, state) = cache.load(self, ifs, efs)
+            else:
+                state = self.prepare_upgrade(serial, ifs, efs)
+                if cache:
+                    cache.store(self, serial, state, ifs, efs)
+            self.verify_upgrade(serial, ifs, efs, state)
+        finally:
+            self.reset()
+
+    def measure_upgrade(self, serial: str, ifs: str, efs: str) -> UpgradeStats:
+        """
+        Runs the upgrade test and measures the first boot of the new firmware
+        on the prepared state, compared to a boot on a fresh state.
+        """
         try:
+            with TemporaryDirectory() as d:
+                with spawn_device(
+                    ifs=os.path.join(d, "ifs.bin"),
+                    efs=os.path.join(d, "efs.bin"),
+                ) as device:
+                    fresh_boot_time = device.spawn_time
+
             with spawn_device(
                 serial=serial, ifs=ifs, efs=efs, suffix="old",
             ) as device:
                 with self.context(device) as context:
                     state = self.prepare(context)
+                free_blocks_before = get_free_blocks(device)
+
             with spawn_device(
                 serial=serial, ifs=ifs, efs=efs, provision=False,
             ) as device:
+                upgrade_boot_time = device.spawn_time
+                free_blocks_after = get_free_blocks(device)
+                start = time.monotonic()
                 with self.context(device) as context:
                     self.verify(context, state)
+                verify_time = time.monotonic() - start
         finally:
             self.reset()
 
+        return UpgradeStats(
+            fresh_boot_time=fresh_boot_time,
+            upgrade_boot_time=upgrade_boot_time,
+            verify_time=verify_time,
+            free_blocks_before=free_blocks_before,
+            free_blocks_after=free_blocks_after,
+        )
+
+    def bisect(
+        self,
+        serial: str,
+        ifs: str,
+        efs: str,
+        binaries: Sequence[str],
+        cache: Optional["CacheEntry"] = None,
+    ) -> Optional[str]:
+        """
+        Prepares the state once with the old firmware and verifies it with
+        the given runner binaries, ordered from the oldest to the newest
+        build, using a binary search.  Returns the first binary that fails
+        the verification, assuming that all later binaries fail too, or None
+        if the newest binary passes.
+        """
+        with TemporaryDirectory() as d:
+            if not cache:
+                cache = CacheEntry(os.path.join(d, "state"))
+            if not cache.exists:
+                try:
+                    state = self.prepare_upgrade(serial, ifs, efs)
+                finally:
+                    self.reset()
+                cache.store(self, serial, state, ifs, efs)
+
+            lo = 0
+            hi = len(binaries)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._verify_cached(cache, ifs, efs, binaries[mid]):
+                    lo = mid + 1
+                else:
+                    hi = mid
+
+        if lo < len(binaries):
+            return binaries[lo]
+        return None
+
+    def _verify_cached(
+        self, cache: "CacheEntry", ifs: str, efs: str, binary: str
+    ) -> bool:
+        (serial, state) = cache.load(self, ifs, efs)
+        try:
+            self.verify_upgrade(serial, ifs, efs, state, binary=binary)
+        except (Exception, RunnerCrashed):
+            # a crashing runner is a failing build, not a failure of the
+            # bisect
+            logger.info(f"bisect: {binary} failed", exc_info=True)
+            return False
+        finally:
+            self.reset()
+        logger.info(f"bisect: {binary} passed")
+        return True
+
 
 class ExecUpgradeTest(UpgradeTest[Context, State]):
     """
@@ -72,3 +245,84 @@ class ExecUpgradeTest(UpgradeTest[Context, State]):
     """
     def test(self, device: Device) -> None:
         self.run(device)
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CacheEntry:
+    """
+    The state of a single upgrade test prepared with the old firmware:  the
+    ifs.bin and efs.bin images, the serial of the device and the serialized
+    state returned by `UpgradeTest.prepare`.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, "state.pickle"))
+
+    def store(
+        self,
+        test: UpgradeTest[Any, State],
+        serial: str,
+        state: State,
+        ifs: str,
+        efs: str,
+    ) -> None:
+        parent = os.path.dirname(self.path)
+        os.makedirs(parent, exist_ok=True)
+        # write to a temporary directory first so that aborted runs do not
+        # leave incomplete entries behind
+        tmp = mkdtemp(dir=parent)
+        try:
+            shutil.copyfile(ifs, os.path.join(tmp, "ifs.bin"))
+            shutil.copyfile(efs, os.path.join(tmp, "efs.bin"))
+            with open(os.path.join(tmp, "serial"), "w") as f:
+                f.write(serial)
+            with open(os.path.join(tmp, "state.pickle"), "wb") as f:
+                f.write(test.dump_state(state))
+            if os.path.exists(self.path):
+                shutil.rmtree(self.path)
+            os.rename(tmp, self.path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    def load(
+        self, test: UpgradeTest[Any, State], ifs: str, efs: str
+    ) -> Tuple[str, State]:
+        # the verification step modifies the images, so we work on copies
+        shutil.copyfile(os.path.join(self.path, "ifs.bin"), ifs)
+        shutil.copyfile(os.path.join(self.path, "efs.bin"), efs)
+        with open(os.path.join(self.path, "serial")) as f:
+            serial = f.read()
+        with open(os.path.join(self.path, "state.pickle"), "rb") as f:
+            state = test.load_state(f.read())
+        return (serial, state)
+
+
+class StateCache:
+    """
+    A cache for the state prepared by the old firmware in upgrade tests.  The
+    entries are keyed by the hashes of the old runner and provisioner
+    binaries and by the test id, so the preparation step only has to be
+    repeated if one of the old binaries changes.
+    """
+    def __init__(
+        self, path: str = UPGRADE_CACHE_PATH, suffix: str = "old"
+    ) -> None:
+        h = hashlib.sha256()
+        for binary in ["usbip-runner", "usbip-provisioner"]:
+            h.update(hash_file(get_binary(binary, suffix)).encode())
+        self.path = os.path.join(path, h.hexdigest()[:16])
+
+    def entry(self, test_id: str) -> CacheEntry:
+        name = re.sub(r"[^\w.-]+", "_", test_id)
+        return CacheEntry(os.path.join(self.path, name))